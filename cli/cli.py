@@ -1,32 +1,36 @@
-import shutil
+import time
 from pathlib import Path
 
 import click
-import funcy
-import peewee
-import yaml
-from peewee import DatabaseError
-from rich import print, rule
-from rich.console import Console
-from rich.text import Text
-from yaml import Loader, load_all
-
-from planner import config, models, logger
-from planner.database import DB
+from rich import print
+
+from planner import config, logger
 from planner.errors import ParsingError
-from planner.io import load_all_yaml_from_file
-from planner.models import Ingredient
-from . import ingredient_list_app, explore
+from planner.export import ARCHIVE_FORMATS, FORMATS
+
+# textual, prettytable and most of rich are imported by the commands that
+# render with them, to keep the startup of the other commands fast. So are
+# peewee, yaml and the database modules, by the commands using the database
 
 
 def print_success(text):
+    from rich.text import Text
+
     print(Text(text, style="green"))
 
 
 def print_error(text):
+    from rich.text import Text
+
     print(Text(text, style="red"))
 
 
+def print_rule(title):
+    from rich.rule import Rule
+
+    print(Rule(title))
+
+
 # ------------------------- main -------------------------
 
 
@@ -35,11 +39,18 @@ main = click.Group()
 
 @main.command("config")
 def config_() -> None:
+    from planner.database import DB
+
     print(config.as_dict())
+    print_rule("database pragmas")
+    print(DB.pragmas())
 
 
 @main.command("status")
 def db_summary() -> None:
+    from planner import models
+    from . import explore
+
     for model in [models.Project, models.Recipe, models.Ingredient, models.Tag]:
         print(f"{model.__name__} : {explore.count_instances(model)}")
 
@@ -51,11 +62,32 @@ db = click.Group("db")
 main.add_command(db)
 
 
+@db.command("create")
+def create_db() -> None:
+    """Create missing tables"""
+    from planner import models
+
+    models.create_tables()
+
+
 @db.command("reset")
 def reset_db() -> None:
+    from planner import models
+
     models.reset_tables()
 
 
+@db.command("migrate")
+def migrate_db() -> None:
+    """Upgrade the database schema, keeping its content"""
+    from planner import migrations
+
+    applied = migrations.migrate()
+    for migration in applied:
+        print(f"migrated to version {migration.version}: {migration.name}")
+    print(f"database at version {migrations.current_version()}")
+
+
 # ------------------------- tags -------------------------
 
 tags = click.Group("tags")
@@ -64,12 +96,17 @@ main.add_command(tags)
 
 @tags.command("list")
 def list_tags() -> None:
+    from planner import models
+    from . import explore
+
     explore.print_instances_table(models.Tag)
 
 
 @tags.command("create")
 @click.argument("name", type=click.STRING)
 def create_tag(name) -> None:
+    from planner import models
+
     tag = models.Tag.create(name=name)
     print_success(f"tag created: {tag!r}")
 
@@ -77,8 +114,10 @@ def create_tag(name) -> None:
 @tags.command("delete")
 @click.argument("id", type=click.INT)
 def delete_tag(id) -> None:
+    from planner import models
+
     tag = models.Tag.get_by_id(id)
-    tag.delete_instance()
+    tag.delete_instance(recursive=True)
     print_success(f"tag removed: {tag!r}")
 
 
@@ -86,26 +125,22 @@ def delete_tag(id) -> None:
 @click.argument("file", type=click.Path(exists=True, readable=True))
 @click.option("--create-tags", is_flag=True)
 def update_tags_from_file(file, create_tags) -> None:
+    from yaml import Loader, load_all
+
+    from planner import bulk
+
     ingredient_update = list(load_all(Path(file).open(), Loader=Loader))
-    tag_names = set(
-        funcy.flatten(ingredient["tags"] for ingredient in ingredient_update)
+    report = bulk.update_tags(ingredient_update, create_tags=create_tags)
+    for tag_name in report.tags_created:
+        print_success(f"tag created: {tag_name!r}")
+    for tag_name in report.missing_tags:
+        print_error(f"could not find tag: {tag_name}")
+    for name in report.missing_ingredients:
+        print_error(f"could not find ingredient: {name}")
+    print_success(
+        f"{report.added} tags added, {report.skipped} already set, "
+        f"{len(report.missing_ingredients)} ingredients missing"
     )
-    if create_tags:
-        tags = {}
-        for tag_name in tag_names:
-            tag, created = models.Tag.get_or_create(name=tag_name)
-            if created:
-                print_success(f"tag created: {tag!r}")
-            tags[tag_name] = tag
-    else:
-        tags = {tag_name: models.Tag.get(name=tag_name) for tag_name in tag_names}
-    for update_item in ingredient_update:
-        try:
-            ingredient = models.Ingredient.get(name=update_item["name"])
-            for tag in (tags[tag_name] for tag_name in update_item["tags"]):
-                ingredient.add_tag(tag)
-        except peewee.DoesNotExist:
-            print_error(f"could not find ingredient: {update_item['name']}")
 
 
 # ------------------------- ingredient -------------------------
@@ -116,13 +151,37 @@ main.add_command(ingredient)
 
 @ingredient.command("list")
 def list_ingredient() -> None:
-    list_app = ingredient_list_app.IngredientsVisualizer(models.Ingredient.select())
+    from . import ingredient_list_app
+
+    list_app = ingredient_list_app.IngredientsVisualizer()
     list_app.run()
 
 
+@ingredient.command("conversion")
+@click.argument("name", type=click.STRING)
+@click.option("--density", type=click.FLOAT, help="kilograms per liter")
+@click.option("--unit-weight", type=click.FLOAT, help="kilograms per unit")
+def set_conversion(name, density, unit_weight) -> None:
+    """Set how the units of an ingredient convert to each other"""
+    from planner import models
+    from planner.parse import normalize_string
+
+    conversion, _ = models.IngredientConversion.get_or_create(
+        name=normalize_string(name)
+    )
+    conversion.density = density
+    conversion.unit_weight = unit_weight
+    conversion.save()
+    print_success(
+        f"conversion of {conversion.name!r}: density={density}, unit weight={unit_weight}"
+    )
+
+
 @ingredient.command("show")
 @click.argument("id", type=click.INT)
 def show_ingredient(id) -> None:
+    from planner import models
+
     instance = models.Ingredient.get_by_id(id)
     print(instance.dump())
 
@@ -130,27 +189,37 @@ def show_ingredient(id) -> None:
 @ingredient.command("export")
 @click.argument("file", type=click.Path(writable=True))
 def dump_ingredients(file) -> None:
+    import yaml
+
+    from planner import models
+
     print(f"writing ingredients in {file!r}")
-    serialized = [ingredient.dump() for ingredient in models.Ingredient.select()]
+    ingredients = models.Ingredient.prefetch_tags(models.Ingredient.select())
+    serialized = [ingredient.dump() for ingredient in ingredients]
     yaml.dump_all(serialized, Path(file).open("w"))
 
 
 @ingredient.command("import")
 @click.argument("file", type=click.Path(readable=True))
 def import_ingredients(file) -> None:
+    from peewee import DatabaseError
+
+    from planner import bulk
+    from planner.io import load_all_yaml_from_file
+
     logger.info(f"importing ingredients from {file}")
-    ingredient_data = load_all_yaml_from_file(file)
-    ingredients = [
-        Ingredient(**funcy.project(data, keys=("name", "unit")))
-        for data in ingredient_data
-    ]
-    logger.info(f"{len(ingredients)} ingredients extracted")
-    for ingredient in ingredients:
-        try:
-            ingredient.save()
-            logger.debug(f"ingredient inserted: {ingredient}")
-        except peewee.IntegrityError:
-            logger.warning(f"ingredient insertion failed: {ingredient}")
+    try:
+        report = bulk.import_ingredients(load_all_yaml_from_file(file))
+    except DatabaseError as exc:
+        print_error(f"error from database during import. operation canceled: {exc}")
+        return
+    for index, error in report.errors.items():
+        print_error(f"could not import record {index}: {error}")
+    for tag_name in report.tags_created:
+        print_success(f"tag created: {tag_name!r}")
+    print_success(
+        f"{len(report.created)} ingredients created, {len(report.updated)} updated"
+    )
 
 
 # ------------------------- recipe -------------------------
@@ -163,6 +232,9 @@ main.add_command(recipe)
 @recipe.command("list")
 def list_recipe() -> None:
     """List recipes"""
+    from planner import models
+    from . import explore
+
     explore.print_instances_table(models.Recipe)
 
 
@@ -171,27 +243,84 @@ def list_recipe() -> None:
     "file",
     type=click.Path(exists=True, readable=True, resolve_path=True),
 )
-def load_recipe_into_database(file):
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=lambda: config.get("parse_jobs", 1),
+    help="number of processes parsing recipe files",
+)
+@click.option("--no-cache", is_flag=True, help="parse all files again")
+def load_recipe_into_database(file, jobs, no_cache):
+    from peewee import DatabaseError
+
+    from planner import bulk, models
+    from planner.cache import ParseCache
+
     try:
         if (path := Path(file)).is_file():
             models.Recipe.create_from_file(path)
         else:
             print(f"loading recipes from directory: {path}")
-            with DB().atomic():
-                for file_path in path.iterdir():
-                    models.Recipe.create_from_file(file_path)
+            report = bulk.load_recipe_files(
+                sorted(path.iterdir()),
+                jobs=jobs,
+                cache=None if no_cache else ParseCache.from_config(),
+            )
+            for file_path, error in report.errors.items():
+                print_error(f"could not load {file_path.name!r}: {error}")
+            print_success(
+                f"{len(report.created)} recipes created, {len(report.skipped)} already existed"
+            )
     except ParsingError as exc:
         print_error(f"error during parsing. operation canceled: {exc}")
     except DatabaseError as exc:
         print_error(f"error from database during loading. operation canceled: {exc}")
 
 
+@recipe.command("sync")
+@click.argument(
+    "directory",
+    type=click.Path(exists=True, file_okay=False, readable=True, resolve_path=True),
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=lambda: config.get("parse_jobs", 1),
+    help="number of processes parsing recipe files",
+)
+@click.option("--no-cache", is_flag=True, help="parse all files again")
+def sync_recipes(directory, jobs, no_cache):
+    """Update recipes from the files of a directory"""
+    from peewee import DatabaseError
+
+    from planner import bulk
+    from planner.cache import ParseCache
+
+    try:
+        report = bulk.sync_recipe_directory(
+            directory,
+            jobs=jobs,
+            cache=None if no_cache else ParseCache.from_config(),
+        )
+    except DatabaseError as exc:
+        print_error(f"error from database during sync. operation canceled: {exc}")
+        return
+    for file_path, error in report.errors.items():
+        print_error(f"could not sync {file_path.name!r}: {error}")
+    print_success(
+        f"{len(report.created)} recipes created, {len(report.updated)} updated, "
+        f"{len(report.deleted)} deleted, {len(report.unchanged)} unchanged"
+    )
+
+
 @recipe.command("show")
 @click.option("--name", type=click.STRING)
 @click.option("--id", type=click.INT)
 @click.option("--rescale", type=click.FLOAT)
 def show_recipe(name, id, rescale: int | None = None) -> None:
     """Prin the recipe, with optional rescaling."""
+    from planner import models
+
     if id is not None:
         recipe = models.Recipe.get_by_id(id)
     elif name is not None:
@@ -200,7 +329,7 @@ def show_recipe(name, id, rescale: int | None = None) -> None:
         print_error("recipe not found")
     if rescale:
         recipe = recipe.rescale(rescale)
-    print(rule.Rule(recipe.name))
+    print_rule(recipe.name)
     print(recipe.full())
 
 
@@ -216,10 +345,12 @@ main.add_command(project)
 
 
 def select_project(name):
+    from planner import models
+
     if name is not None:
         try:
             return models.Project.get(name=name)
-        except peewee.DoesNotExist:
+        except models.Project.DoesNotExist:
             raise ValueError(f"no project named {name}")
     else:
         print("using default project")
@@ -229,12 +360,45 @@ def select_project(name):
 @project.command("create")
 @click.argument("name", type=click.STRING)
 def create_project(name):
+    from planner import models
+
     models.Project.create(name=name)
     print_success("project created")
 
 
+@project.command("import")
+@click.argument(
+    "path",
+    type=click.Path(exists=True, readable=True, resolve_path=True),
+)
+def import_projects(path) -> None:
+    """Create projects from a project file or a directory of them"""
+    from peewee import DatabaseError
+
+    from planner import bulk
+
+    path = Path(path)
+    paths = [path] if path.is_file() else sorted(path.glob("*.yaml"))
+    try:
+        report = bulk.import_project_files(paths)
+    except DatabaseError as exc:
+        print_error(f"error from database during import. operation canceled: {exc}")
+        return
+    for file_path, error in report.errors.items():
+        print_error(f"could not import {file_path.name!r}: {error}")
+    for project_name, recipe_names in report.missing_recipes.items():
+        for recipe_name in recipe_names:
+            print_error(f"recipe not found for {project_name!r}: {recipe_name!r}")
+    print_success(
+        f"{len(report.created)} projects created, {len(report.skipped)} already existed"
+    )
+
+
 @project.command("list")
 def list_projects() -> None:
+    from planner import models
+    from . import explore
+
     explore.print_instances_table(models.Project)
 
 
@@ -248,12 +412,14 @@ def show_project(name) -> None:
 @project.command("delete")
 @click.argument("name", type=click.STRING)
 def delete_project(name) -> None:
+    from planner import models
+
     try:
         project = models.Project.get(name=name)
-    except peewee.DoesNotExist:
+    except models.Project.DoesNotExist:
         print_error(f"no project named {name}")
         return
-    project.delete_instance()
+    project.delete_instance(recursive=True)
     print_success(f"project deleted: {project.name}")
 
 
@@ -274,6 +440,8 @@ def delete_project(name) -> None:
 @click.option("--project", type=click.STRING)
 def add_recipe_to_project(file, name, id, servings, project):
     "Add recipe file to default project"
+    from planner import models
+
     # project
     project = select_project(project)
     # recipe
@@ -296,49 +464,108 @@ def add_recipe_to_project(file, name, id, servings, project):
 
 
 @project.command()
-@click.option("--csv", is_flag=True)
+@click.option("--csv", is_flag=True, help="same as --format csv")
+@click.option("--format", "format_", type=click.Choice(FORMATS))
 @click.option("--name", type=click.STRING)
-def shopping_list(csv, name) -> None:
+def shopping_list(csv, format_, name) -> None:
+    from planner.export import write_shopping_list
+
     project = select_project(name)
-    if csv is True:
-        print(project.csv_shopping_list())
+    if csv is True and format_ is None:
+        format_ = "csv"
+    if format_ is not None:
+        write_shopping_list(
+            project.iter_shopping_lines(), click.get_text_stream("stdout"), format_
+        )
     else:
         print(project.detail_printable())
         print(project.shopping_list_table())
 
 
+def parse_servings_list(context, parameter, value):
+    try:
+        servings = [int(number) for number in value.split(",")]
+    except ValueError:
+        raise click.BadParameter(f"not a comma separated list of integers: {value}")
+    if any(number <= 0 for number in servings):
+        raise click.BadParameter("servings must be positive")
+    return servings
+
+
+@project.command()
+@click.option(
+    "--servings",
+    required=True,
+    callback=parse_servings_list,
+    help="comma separated numbers of persons, e.g. 150,200,240",
+)
+@click.option("--name", type=click.STRING)
+def sweep(servings, name) -> None:
+    """Compare shopping lists for several numbers of persons"""
+    project = select_project(name)
+    print(project.servings_sweep_table(servings))
+
+
+@project.command()
+@click.argument(
+    "directory",
+    type=click.Path(exists=True, file_okay=False, readable=True, resolve_path=True),
+)
+@click.option("--name", type=click.STRING)
+@click.option("--interval", type=click.FLOAT, default=0.5, help="polling period")
+def watch(directory, name, interval) -> None:
+    """Follow recipe files and show shopping list changes"""
+    from planner import bulk
+    from planner import watch as planner_watch
+
+    project = select_project(name)
+    report = bulk.sync_recipe_directory(directory)
+    for file_path, error in report.errors.items():
+        print_error(f"could not sync {file_path.name!r}: {error}")
+    print(project.shopping_list_table())
+    print(f"watching {directory}, press ctrl-c to stop")
+    try:
+        for report, diff in planner_watch.watch(project, directory, interval):
+            print_rule(time.strftime("%H:%M:%S"))
+            for recipe_name in report.created + report.updated + report.deleted:
+                print(f"recipe synced: {recipe_name}")
+            for file_path, error in report.errors.items():
+                print_error(f"could not sync {file_path.name!r}: {error}")
+            if not diff:
+                print("shopping list unchanged")
+            for ingredient, before, after in diff:
+                if before is None:
+                    print_success(f"+ {ingredient.name}: {after:.1f} {ingredient.unit}")
+                elif after is None:
+                    print_error(f"- {ingredient.name}: {before:.1f} {ingredient.unit}")
+                else:
+                    print(
+                        f"~ {ingredient.name}: {before:.1f} -> {after:.1f} {ingredient.unit}"
+                    )
+    except KeyboardInterrupt:
+        print("stopped watching")
+
+
 @project.command()
 @click.argument("id", type=click.INT)
-def export(id) -> None:
-    # get project
+@click.option(
+    "--archive",
+    type=click.Choice(ARCHIVE_FORMATS),
+    help="write a single archive instead of a directory",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=lambda: config.get("export_jobs", 4),
+    help="number of threads rendering and writing files",
+)
+def export(id, archive, jobs) -> None:
+    from planner import models
+    from planner.export import export_project
+
     project = models.Project.get_by_id(id)
-    # ensure empty dir
-    target_dir = Path("projects") / project.name
-    if target_dir.exists():
-        print(f"deleting directory: {target_dir}")
-        shutil.rmtree(target_dir)
-    print(f"creating directory: {target_dir}")
-    target_dir.mkdir()
-    # make summary file
-    summary_file = target_dir / "summary.txt"
-    with summary_file.open("w") as file:
-        console = Console(file=file)
-        print(f"writing summary : {summary_file}")
-        console.print(project.detail_printable())
-    # print csv shopping list in a file
-    shopping_list_file = target_dir / "shopping_list.csv"
-    print(f"writing shopping list : {shopping_list_file}")
-    shopping_list_file.write_text(project.csv_shopping_list())
-    # for each item, print scaled recipe in a file
-    for item in project.items:
-        recipe_file = (target_dir / item.recipe.name).with_suffix(".txt")
-        print(f"writing recipe file: {recipe_file}")
-        recipe_file.write_text(item.recipe.as_text(servings=item.servings))
-    # copy logs
-    source_log_file = Path("logs.txt")
-    log_file = target_dir / "logs.txt"
-    print(f"copying logs: {log_file}")
-    shutil.copy(source_log_file, log_file)
+    target = export_project(project, Path("projects") / project.name, archive, jobs)
+    print_success(f"project exported: {target}")
 
 
 if __name__ == "__main__":
@@ -2,7 +2,6 @@
 
 import peewee
 from rich import print
-from rich.table import Table
 
 
 def count_instances(model) -> int:
@@ -40,6 +39,8 @@ def _field_as_string(field):
 
 def print_instances_table(model):
     """Print a table of instances"""
+    from rich.table import Table
+
     instances = model.select()
     if not instances:
         print(f"no {model.__name__} in the database")
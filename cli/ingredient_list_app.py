@@ -1,16 +1,37 @@
+import asyncio
+
+from textual import work
 from textual.app import App, ComposeResult
 from textual.widgets import DataTable, Header, Footer, Input, Static
 from textual.containers import Container
 
+from planner.models import Ingredient
+from planner.search import SearchIndex
+
+# seconds without typing before the table is filtered
+FILTER_DELAY = 0.15
+# ingredients loaded per query
+PAGE_SIZE = 1000
+
 
 class IngredientsVisualizer(App):
-    """A simple TUI app to display ingredients in a table."""
+    """A simple TUI app to display ingredients in a table.
+
+    Ingredients are loaded page by page by a worker, the app stays usable
+    in between. The table only renders the rows in view.
+    """
 
     CSS_PATH = """./app.tcss"""
 
-    def __init__(self, ingredients):
+    def __init__(self, page_size=PAGE_SIZE):
         super().__init__()
-        self.ingredients = ingredients
+        self.page_size = page_size
+        self.rows = {}  # row key -> (id, name, unit, price, tags, category)
+        self.index = SearchIndex()
+        self.shown = set()  # row keys in the table
+        self.filter_text = ""
+        self.filter_timer = None
+        self.loading = True
 
     def compose(self) -> ComposeResult:
         """Create child widgets for the app."""
@@ -26,43 +47,86 @@ class IngredientsVisualizer(App):
         table = self.query_one("#ingredients-table", DataTable)
 
         # Add columns
-        table.add_columns("Name", "Unit")
+        table.add_column("Id", key="id")
+        table.add_column("Name", key="name")
+        table.add_column("Unit", key="unit")
+        table.add_column("Price", key="price")
+        table.add_column("Category", key="category")
+        table.add_column("Tags", key="tags")
 
         # Configure table for row-by-row navigation
         table.cursor_type = "row"
 
-        self.update_table("")
+        self.update_count()
+        self.load_rows()
+
+    @work(exclusive=True)
+    async def load_rows(self) -> None:
+        """Load ingredients by pages, handling events between them."""
+        after = 0
+        while page := list(Ingredient.listing(after=after, limit=self.page_size)):
+            self.add_rows(page)
+            after = page[-1][0]
+            await asyncio.sleep(0)
+        self.loading = False
+        self.update_count()
+
+    def add_rows(self, rows) -> None:
+        """Add loaded rows, showing the ones matching the filter."""
+        table = self.query_one("#ingredients-table", DataTable)
+        for row in rows:
+            key = str(row[0])
+            self.rows[key] = row
+            self.index.add(key, row[1])
+            if self.filter_text.lower() in row[1].lower():
+                table.add_row(*self.cells(row), key=key)
+                self.shown.add(key)
+        self.update_count()
+
+    @staticmethod
+    def cells(row) -> tuple:
+        id_, name, unit, price, tags, category = row
+        price = f"{price:.2f}" if price is not None else ""
+        return id_, name, unit, price, category, tags or ""
 
     def update_table(self, filter_text: str) -> None:
         """Update table content based on filter."""
         table = self.query_one("#ingredients-table", DataTable)
-
-        # Clear existing rows
-        table.clear()
-
-        # Filter ingredients by name (case-insensitive)
-        filtered_ingredients = [
-            ingredient
-            for ingredient in self.ingredients
-            if filter_text.lower() in ingredient.name.lower()
-        ]
-
-        # Add filtered rows
-        for ingredient in filtered_ingredients:
-            table.add_row(ingredient.name, ingredient.unit)
-
-        # Update count display
+        self.filter_text = filter_text
+
+        # Only remove and add the rows that changed
+        matches = self.index.search(filter_text)
+        matching = set(matches)
+        for key in self.shown - matching:
+            table.remove_row(key)
+        added = [key for key in matches if key not in self.shown]
+        for key in added:
+            table.add_row(*self.cells(self.rows[key]), key=key)
+        if added and len(added) < len(matches):
+            table.sort("id")
+        self.shown = matching
+
+        self.update_count()
+
+    def update_count(self) -> None:
         count_display = self.query_one("#count-display")
 
-        total_count = len(self.ingredients)
-        filtered_count = len(filtered_ingredients)
+        total_count = len(self.index)
+        filtered_count = len(self.shown)
 
-        if filter_text:
-            count_display.update(f"{filtered_count}/{total_count} ingredients")
+        if self.filter_text:
+            text = f"{filtered_count}/{total_count} ingredients"
         else:
-            count_display.update(f"{total_count} ingredients")
+            text = f"{total_count} ingredients"
+        if self.loading:
+            text += " (loading)"
+        count_display.update(text)
 
     def on_input_changed(self, event: Input.Changed) -> None:
-        """Handle input changes for filtering."""
+        """Handle input changes for filtering, once typing pauses."""
         if event.input.id == "filter-input":
-            self.update_table(event.value)
+            if self.filter_timer is not None:
+                self.filter_timer.stop()
+            self.filter_timer = self.set_timer(
+                FILTER_DELAY, lambda: self.update_table(event.value)
+            )
@@ -0,0 +1,92 @@
+"""Compare database profiles on a large generated recipe library
+
+usage: uv run python dev/bench_db_profile.py [RECIPES]
+"""
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from planner import bulk, config, logger, models
+from planner.database import DB, PROFILES
+from planner.parse import Quantity
+
+UNITS = ["g", "kg", "ml", "l", "tsp", "tbsp", ""]
+
+
+def write_recipes(directory, count, ingredients=1500, items=15):
+    rng = random.Random(0)
+    paths = []
+    for index in range(count):
+        lines = [
+            f"- {rng.randint(1, 500)}{rng.choice(UNITS)} ingredient {rng.randrange(ingredients)}"
+            for _ in range(items)
+        ]
+        path = directory / f"recipe {index}"
+        path.write_text("\n".join(["serves: 10", "---", *lines]))
+        paths.append(path)
+    return paths
+
+
+def use_database(path, profile):
+    config.set("in_memory", False)
+    config.set("database_file", str(path))
+    config.set("db_profile", profile)
+    DB._instance = None
+    DB().bind(models.all_models)
+    models.create_tables()
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench(profile, recipes, work_dir):
+    use_database(work_dir / f"{profile} bulk.db", profile)
+    bulk_load = timed(lambda: bulk.insert_recipes(recipes))
+    project = models.Project.create(name="festival")
+    for recipe in models.Recipe.select().limit(200):
+        project.add_recipe(recipe, servings=240)
+    shopping_list = timed(lambda: [project.shopping_list() for _ in range(20)]) / 20
+    DB().close()
+
+    # one transaction per recipe, one statement per item
+    use_database(work_dir / f"{profile} per recipe.db", profile)
+
+    def load_per_recipe():
+        for parsed in recipes[:200]:
+            with DB().atomic():
+                recipe = models.Recipe.create(name=parsed.name, serves=parsed.serves)
+                for number, name, unit in parsed.items:
+                    recipe.add_item(Quantity(number, unit), name)
+
+    per_recipe_load = timed(load_per_recipe)
+    DB().close()
+    return bulk_load, per_recipe_load, shopping_list
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    logger.remove()
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        (recipes_dir := work_dir / "recipes").mkdir()
+        recipes = [
+            parsed
+            for _, parsed in bulk.parse_recipe_files(write_recipes(recipes_dir, count))
+        ]
+        print(
+            f"{'profile':<10}{'bulk load':>12}{'200 recipes':>14}{'shopping list':>15}"
+        )
+        for profile in PROFILES:
+            bulk_load, per_recipe_load, shopping_list = bench(
+                profile, recipes, work_dir
+            )
+            print(
+                f"{profile:<10}{bulk_load:>11.2f}s{per_recipe_load:>13.2f}s"
+                f"{shopping_list * 1000:>13.1f}ms"
+            )
@@ -0,0 +1,33 @@
+"""Measure item line parsing speed over all shipped recipes
+
+usage: uv run python dev/bench_parse.py
+"""
+
+import timeit
+from pathlib import Path
+
+from planner.io import load_yaml
+from planner.parse import _parse_item_line, _split_recipe_file
+
+RECIPES = Path(__file__).parent.parent / "assets" / "recipes"
+REPEAT = 5
+
+
+def item_lines():
+    lines = []
+    for path in sorted(RECIPES.iterdir()):
+        _, _, items, _ = _split_recipe_file(path)
+        lines.extend(load_yaml(items))
+    return lines
+
+
+def parse_all(lines):
+    for line in lines:
+        _parse_item_line(line)
+
+
+if __name__ == "__main__":
+    lines = item_lines()
+    number = 20
+    best = min(timeit.repeat(lambda: parse_all(lines), number=number, repeat=REPEAT))
+    print(f"{len(lines)} lines: {len(lines) * number / best:,.0f} lines/s")
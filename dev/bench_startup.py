@@ -0,0 +1,35 @@
+"""Measure the import time of the CLI, before any command runs
+
+usage: uv run python dev/bench_startup.py
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+# generous, the point is to catch heavy imports creeping back at module level
+STARTUP_BUDGET = 1.0  # seconds
+REPEAT = 5
+
+
+def import_time(module) -> float:
+    """Cumulative import time of `module` in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+    )
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1e6
+    raise ValueError(f"no import time for {module}")
+
+
+if __name__ == "__main__":
+    best = min(import_time("cli.cli") for _ in range(REPEAT))
+    status = "ok" if best < STARTUP_BUDGET else "over budget"
+    print(f"import cli.cli: {best * 1000:.0f}ms ({status}, budget {STARTUP_BUDGET}s)")
@@ -0,0 +1,725 @@
+"""Bulk operations on the database
+
+Loading many records one by one costs a round trip per row. Functions here
+resolve what already exists with a few `SELECT ... IN` queries, then write
+the rest with batched `INSERT` statements inside a single transaction.
+"""
+
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import peewee
+
+from planner import logger
+from planner.cache import ParseCache
+from planner.database import DB
+from planner.errors import KitchenPlannerError, ParsingError
+from planner.io import load_yaml
+from planner.models import (
+    IN_QUERY_BATCH_SIZE,
+    INSERT_BATCH_SIZE,
+    Ingredient,
+    IngredientTag,
+    Project,
+    ProjectRecipe,
+    Recipe,
+    RecipeItem,
+    RecipeSource,
+    Tag,
+    catalog,
+    mark_all_stale,
+    mark_stale,
+    projects_using_ingredients,
+    projects_using_recipes,
+)
+from planner.parse import Unit, normalize_string, parse_recipe_file
+
+
+@dataclass
+class ParsedRecipe:
+    """Content of a recipe file, ready to be inserted"""
+
+    name: str
+    serves: int
+    instructions: str | None
+    items: list[tuple[float, str, Unit]]
+
+
+@dataclass
+class LoadReport:
+    """Outcome of a bulk load"""
+
+    created: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    errors: dict[Path, Exception] = field(default_factory=dict)
+
+
+@dataclass
+class SyncReport:
+    """Outcome of a recipe synchronization"""
+
+    created: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    unchanged: list[str] = field(default_factory=list)
+    errors: dict[Path, Exception] = field(default_factory=dict)
+
+
+@dataclass
+class IngredientImportReport:
+    """Outcome of an ingredient import"""
+
+    created: list[tuple[str, Unit]] = field(default_factory=list)
+    updated: list[tuple[str, Unit]] = field(default_factory=list)
+    tags_created: list[str] = field(default_factory=list)
+    errors: dict[int, Exception] = field(default_factory=dict)  # by record index
+
+
+@dataclass
+class TagUpdateReport:
+    """Outcome of a tag update, counted in ingredient tag links"""
+
+    added: int = 0
+    skipped: int = 0  # already linked
+    missing_ingredients: list[str] = field(default_factory=list)
+    missing_tags: list[str] = field(default_factory=list)
+    tags_created: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ProjectImportReport:
+    """Outcome of a project import"""
+
+    created: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    missing_recipes: dict[str, list[str]] = field(default_factory=dict)
+    errors: dict[Path, Exception] = field(default_factory=dict)
+
+
+# ------------------------- parsing -------------------------
+
+
+def _to_parsed_recipe(path, parsed) -> ParsedRecipe:
+    name, header, items, instructions = parsed
+    try:
+        serves = header["serves"]
+    except KeyError:
+        raise ParsingError(f"serves missing from header: {path}")
+    return ParsedRecipe(
+        name=name,
+        serves=serves,
+        instructions=instructions,
+        items=[
+            (quantity.number, normalize_string(ingredient), quantity.unit)
+            for quantity, ingredient in items
+        ],
+    )
+
+
+def _parse_recipe_file_or_error(path):
+    """Parsing step run in worker processes, errors are returned to the caller"""
+    try:
+        return parse_recipe_file(path)
+    except ParsingError as exc:
+        return exc
+    except Exception as exc:
+        # the original exception might not survive pickling
+        return ParsingError(f"{type(exc).__name__}: {exc}")
+
+
+def _parse_files(paths, jobs):
+    """Parse files in order, in a pool of processes if `jobs` is above 1"""
+    logger.debug(f"parsing {len(paths)} files with {jobs} jobs")
+    if jobs > 1 and len(paths) > 1:
+        chunksize = max(1, len(paths) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            yield from executor.map(
+                _parse_recipe_file_or_error, paths, chunksize=chunksize
+            )
+    else:
+        yield from map(_parse_recipe_file_or_error, paths)
+
+
+def parse_recipe_files(paths, jobs=1, cache: ParseCache | None = None):
+    """Parse recipe files, yield `(path, parsed recipe or exception)`
+
+    A broken file doesn't stop the iteration, its error is yielded instead.
+    With `jobs` above 1, files are parsed in a pool of processes, and results
+    are yielded in the order of `paths` as they come. Files found in `cache`
+    are not parsed again.
+    """
+    paths = list(paths)
+    cached = {}
+    if cache is not None:
+        for path in paths:
+            if (parsed := cache.get(path)) is not None:
+                cached[path] = parsed
+        logger.debug(f"{len(cached)}/{len(paths)} files found in parse cache")
+    parsed_files = _parse_files([path for path in paths if path not in cached], jobs)
+    for path in paths:
+        if path in cached:
+            parsed = cached[path]
+        else:
+            parsed = next(parsed_files)
+            if isinstance(parsed, Exception):
+                yield path, parsed
+                continue
+            if cache is not None:
+                cache.put(path, parsed)
+        try:
+            yield path, _to_parsed_recipe(path, parsed)
+        except ParsingError as exc:
+            yield path, exc
+    if cache is not None:
+        cache.evict()
+
+
+# ------------------------- database -------------------------
+
+
+def _insert_batched(model, rows) -> None:
+    for batch in peewee.chunked(rows, INSERT_BATCH_SIZE):
+        model.insert_many(batch).execute()
+
+
+def _select_ingredient_ids(names) -> dict[tuple[str, Unit], int]:
+    ids = {}
+    for batch in peewee.chunked(names, IN_QUERY_BATCH_SIZE):
+        query = (
+            Ingredient.select(Ingredient.id, Ingredient.name, Ingredient.unit)
+            .where(Ingredient.name.in_(batch))
+            .tuples()
+        )
+        for id_, name, unit in query:
+            ids[name, unit] = id_
+    return ids
+
+
+def resolve_ingredients(keys) -> dict[tuple[str, Unit], int]:
+    """Map `(name, unit)` pairs to ingredient ids, creating missing ingredients"""
+    keys = set(keys)
+    names = sorted({name for name, _ in keys})
+    ids = _select_ingredient_ids(names)
+    missing = sorted(keys - ids.keys())
+    if missing:
+        _insert_batched(
+            Ingredient, [dict(name=name, unit=unit) for name, unit in missing]
+        )
+        logger.debug(f"{len(missing)} new ingredients created")
+        ids = _select_ingredient_ids(sorted({name for name, _ in missing})) | ids
+    return {key: ids[key] for key in keys}
+
+
+def _select_tag_ids(names) -> dict[str, int]:
+    ids = {}
+    for batch in peewee.chunked(names, IN_QUERY_BATCH_SIZE):
+        query = Tag.select(Tag.id, Tag.name).where(Tag.name.in_(batch))
+        ids.update((name, id_) for id_, name in query.tuples())
+    return ids
+
+
+def _select_recipe_ids(names) -> dict[str, int]:
+    ids = {}
+    for batch in peewee.chunked(names, IN_QUERY_BATCH_SIZE):
+        query = Recipe.select(Recipe.id, Recipe.name).where(Recipe.name.in_(batch))
+        ids.update((name, id_) for id_, name in query.tuples())
+    return ids
+
+
+def insert_recipes(recipes: list[ParsedRecipe]) -> None:
+    """Insert recipes and their items, resolving ingredients in bulk"""
+    ingredient_ids = resolve_ingredients(
+        (name, unit) for recipe in recipes for _, name, unit in recipe.items
+    )
+    _insert_batched(
+        Recipe,
+        [
+            dict(
+                name=recipe.name,
+                serves=recipe.serves,
+                instructions=recipe.instructions,
+            )
+            for recipe in recipes
+        ],
+    )
+    recipe_ids = _select_recipe_ids([recipe.name for recipe in recipes])
+    _insert_batched(
+        RecipeItem,
+        [
+            dict(
+                recipe=recipe_ids[recipe.name],
+                ingredient=ingredient_ids[name, unit],
+                quantity=quantity,
+            )
+            for recipe in recipes
+            for quantity, name, unit in recipe.items
+        ],
+    )
+
+
+def load_recipe_files(paths, jobs=1, cache: ParseCache | None = None) -> LoadReport:
+    """Load recipe files into the database
+
+    All files are parsed first, using `jobs` processes and `cache`. Files
+    that fail to parse are reported and left out, recipes that already exist
+    are skipped. The remaining recipes are inserted in a single transaction.
+    """
+    report = LoadReport()
+    recipes = {}
+    for path, parsed in parse_recipe_files(paths, jobs=jobs, cache=cache):
+        if isinstance(parsed, Exception):
+            logger.warning(f"could not parse {str(path)!r}: {parsed}")
+            report.errors[path] = parsed
+        elif parsed.name in recipes:
+            report.errors[path] = ParsingError(f"duplicate recipe: {parsed.name}")
+        else:
+            recipes[parsed.name] = parsed
+    with DB().atomic():
+        existing = _select_recipe_ids(list(recipes))
+        for name in existing:
+            logger.info(f"recipe already exist: {name}")
+            report.skipped.append(name)
+        new_recipes = [
+            recipe for name, recipe in recipes.items() if name not in existing
+        ]
+        insert_recipes(new_recipes)
+    catalog.invalidate()
+    for recipe in new_recipes:
+        logger.info(f"recipe created: {recipe.name}")
+        report.created.append(recipe.name)
+    return report
+
+
+# ------------------------- synchronization -------------------------
+
+
+def file_hash(path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def _select_sources(paths) -> dict[str, tuple[int, str, str]]:
+    """Map source paths to `(recipe id, recipe name, content hash)`"""
+    sources = {}
+    for batch in peewee.chunked(paths, IN_QUERY_BATCH_SIZE):
+        query = (
+            RecipeSource.select(
+                RecipeSource.path,
+                RecipeSource.recipe,
+                Recipe.name,
+                RecipeSource.content_hash,
+            )
+            .join(Recipe)
+            .where(RecipeSource.path.in_(batch))
+            .tuples()
+        )
+        sources.update((path, rest) for path, *rest in query)
+    return sources
+
+
+def _select_items(recipe_ids) -> dict[int, list[tuple[int, int, float]]]:
+    """Map recipe ids to their `(item id, ingredient id, quantity)`"""
+    items = defaultdict(list)
+    for batch in peewee.chunked(recipe_ids, IN_QUERY_BATCH_SIZE):
+        query = (
+            RecipeItem.select(
+                RecipeItem.recipe,
+                RecipeItem.id,
+                RecipeItem.ingredient,
+                RecipeItem.quantity,
+            )
+            .where(RecipeItem.recipe.in_(batch))
+            .order_by(RecipeItem.id)
+            .tuples()
+        )
+        for recipe_id, *item in query:
+            items[recipe_id].append(tuple(item))
+    return items
+
+
+def _update_recipes(recipes: list[ParsedRecipe], recipe_ids: dict[str, int]):
+    """Apply parsed content to existing recipes, writing only differences"""
+    ingredient_ids = resolve_ingredients(
+        (name, unit) for recipe in recipes for _, name, unit in recipe.items
+    )
+    ids = [recipe_ids[recipe.name] for recipe in recipes]
+    current_items = _select_items(ids)
+    current_recipes = {}
+    for batch in peewee.chunked(ids, IN_QUERY_BATCH_SIZE):
+        query = (
+            Recipe.select(Recipe.id, Recipe.serves, Recipe.instructions)
+            .where(Recipe.id.in_(batch))
+            .tuples()
+        )
+        current_recipes.update((id_, tuple(rest)) for id_, *rest in query)
+    new_items, deleted_items = [], []
+    updated = []
+    for recipe in recipes:
+        recipe_id = recipe_ids[recipe.name]
+        modified = False
+        if current_recipes.get(recipe_id) != (recipe.serves, recipe.instructions):
+            Recipe.update(serves=recipe.serves, instructions=recipe.instructions).where(
+                Recipe.id == recipe_id
+            ).execute()
+            modified = True
+        # pair items by ingredient, in order of appearance
+        unpaired = defaultdict(list)
+        for item_id, ingredient_id, quantity in current_items[recipe_id]:
+            unpaired[ingredient_id].append((item_id, quantity))
+        for quantity, name, unit in recipe.items:
+            ingredient_id = ingredient_ids[name, unit]
+            if unpaired[ingredient_id]:
+                item_id, current_quantity = unpaired[ingredient_id].pop(0)
+                if current_quantity != quantity:
+                    RecipeItem.update(quantity=quantity).where(
+                        RecipeItem.id == item_id
+                    ).execute()
+                    modified = True
+            else:
+                new_items.append(
+                    dict(recipe=recipe_id, ingredient=ingredient_id, quantity=quantity)
+                )
+                modified = True
+        removed = [item_id for items in unpaired.values() for item_id, _ in items]
+        deleted_items.extend(removed)
+        if modified or removed:
+            updated.append(recipe.name)
+    for batch in peewee.chunked(deleted_items, IN_QUERY_BATCH_SIZE):
+        RecipeItem.delete().where(RecipeItem.id.in_(batch)).execute()
+    _insert_batched(RecipeItem, new_items)
+    return updated
+
+
+def _delete_recipes(sources, report: SyncReport):
+    """Delete recipes whose file disappeared, unless a project uses them
+
+    `sources` are `(path, recipe id, recipe name)` of the removed files.
+    """
+    used = set()
+    for batch in peewee.chunked([id_ for _, id_, _ in sources], IN_QUERY_BATCH_SIZE):
+        query = (
+            ProjectRecipe.select(ProjectRecipe.recipe)
+            .where(ProjectRecipe.recipe.in_(batch))
+            .tuples()
+        )
+        used.update(recipe_id for (recipe_id,) in query)
+    deleted = {}
+    for path, recipe_id, name in sources:
+        if recipe_id in used:
+            report.errors[Path(path)] = KitchenPlannerError(
+                f"file removed but recipe used in a project: {name}"
+            )
+        else:
+            deleted[name] = recipe_id
+    for batch in peewee.chunked(list(deleted.values()), IN_QUERY_BATCH_SIZE):
+        RecipeItem.delete().where(RecipeItem.recipe.in_(batch)).execute()
+        RecipeSource.delete().where(RecipeSource.recipe.in_(batch)).execute()
+        Recipe.delete().where(Recipe.id.in_(batch)).execute()
+    for name in deleted:
+        logger.info(f"recipe deleted: {name}")
+        report.deleted.append(name)
+
+
+def sync_recipe_files(
+    paths, removed=(), jobs=1, cache: ParseCache | None = None
+) -> SyncReport:
+    """Bring recipes in line with their files
+
+    Files whose content hash matches the recorded one are not parsed and cost
+    no writes. Edited files update their recipe, new files create one.
+    Recipes loaded from `removed` paths are deleted.
+    """
+    report = SyncReport()
+    paths = [Path(path) for path in paths]
+    removed = [str(Path(path)) for path in removed]
+    sources = _select_sources([str(path) for path in paths] + removed)
+    hashes = {}
+    for path in paths:
+        hashes[path] = file_hash(path)
+        if (source := sources.get(str(path))) and source[2] == hashes[path]:
+            report.unchanged.append(source[1])
+    changed = [
+        path
+        for path in paths
+        if (source := sources.get(str(path))) is None or source[2] != hashes[path]
+    ]
+    recipes = {}
+    for path, parsed in parse_recipe_files(changed, jobs=jobs, cache=cache):
+        if isinstance(parsed, Exception):
+            logger.warning(f"could not parse {str(path)!r}: {parsed}")
+            report.errors[path] = parsed
+        elif parsed.name in recipes:
+            report.errors[path] = ParsingError(f"duplicate recipe: {parsed.name}")
+        else:
+            recipes[parsed.name] = (path, parsed)
+    with DB().atomic():
+        _delete_recipes(
+            [(path, *sources[path][:2]) for path in removed if path in sources],
+            report,
+        )
+        existing = _select_recipe_ids(list(recipes))
+        insert_recipes(
+            [recipe for name, (_, recipe) in recipes.items() if name not in existing]
+        )
+        report.updated = _update_recipes(
+            [recipe for name, (_, recipe) in recipes.items() if name in existing],
+            existing,
+        )
+        report.created = [name for name in recipes if name not in existing]
+        # edits that didn't change the recipe, like formatting
+        report.unchanged.extend(name for name in existing if name not in report.updated)
+        recipe_ids = existing | _select_recipe_ids(report.created)
+        # record new hashes, a recipe has a single source file
+        synced_ids = [recipe_ids[name] for name in recipes]
+        synced_paths = [str(path) for path, _ in recipes.values()]
+        for batch in peewee.chunked(synced_ids, IN_QUERY_BATCH_SIZE):
+            RecipeSource.delete().where(RecipeSource.recipe.in_(batch)).execute()
+        for batch in peewee.chunked(synced_paths, IN_QUERY_BATCH_SIZE):
+            RecipeSource.delete().where(RecipeSource.path.in_(batch)).execute()
+        _insert_batched(
+            RecipeSource,
+            [
+                dict(
+                    recipe=recipe_ids[name],
+                    path=str(path),
+                    content_hash=hashes[path],
+                )
+                for name, (path, _) in recipes.items()
+            ],
+        )
+        # deleted recipes were used by no project, only updates change lists
+        updated_ids = [existing[name] for name in report.updated]
+        for batch in peewee.chunked(updated_ids, IN_QUERY_BATCH_SIZE):
+            mark_stale(projects_using_recipes(batch))
+    catalog.invalidate()
+    for name in report.created:
+        logger.info(f"recipe created: {name}")
+    for name in report.updated:
+        logger.info(f"recipe updated: {name}")
+    return report
+
+
+def sync_recipe_directory(
+    directory, jobs=1, cache: ParseCache | None = None
+) -> SyncReport:
+    """Synchronize recipes with the files of a directory"""
+    directory = Path(directory)
+    paths = sorted(path for path in directory.iterdir() if path.is_file())
+    present = {str(path) for path in paths}
+    removed = [
+        path
+        for (path,) in RecipeSource.select(RecipeSource.path).tuples()
+        if Path(path).parent == directory and path not in present
+    ]
+    return sync_recipe_files(paths, removed=removed, jobs=jobs, cache=cache)
+
+
+# ------------------------- projects -------------------------
+
+
+def _parse_project_file(path) -> tuple[str, int, list[str]]:
+    """Name, servings and recipe names of a project file
+
+    ```project file format
+    servings: 40
+    recipes:
+      - recipe name
+      - other recipe name
+    ```
+    """
+    path = Path(path)
+    data = load_yaml(path.read_text())
+    if not isinstance(data, dict):
+        raise ParsingError(f"project parsing failed: {path}")
+    servings, recipes = data.get("servings"), data.get("recipes")
+    if not isinstance(servings, int):
+        raise ParsingError(f"servings is not an integer: {path}")
+    if not isinstance(recipes, list):
+        raise ParsingError(f"recipes is not a list: {path}")
+    return path.stem, servings, [normalize_string(str(name)) for name in recipes]
+
+
+def import_project_files(paths) -> ProjectImportReport:
+    """Create projects and their recipes from project files
+
+    Projects that already exist are skipped. Recipes not found in the
+    database are reported and left out of their project.
+    """
+    report = ProjectImportReport()
+    projects = {}
+    for path in paths:
+        try:
+            name, servings, recipe_names = _parse_project_file(path)
+        except Exception as exc:
+            logger.warning(f"could not parse {str(path)!r}: {exc}")
+            report.errors[Path(path)] = exc
+            continue
+        if name in projects:
+            report.errors[Path(path)] = ParsingError(f"duplicate project: {name}")
+            continue
+        projects[name] = (servings, recipe_names)
+    with DB().atomic():
+        existing = set()
+        for batch in peewee.chunked(list(projects), IN_QUERY_BATCH_SIZE):
+            query = Project.select(Project.name).where(Project.name.in_(batch))
+            existing.update(name for (name,) in query.tuples())
+        for name in existing:
+            logger.info(f"project already exist: {name}")
+            report.skipped.append(name)
+            del projects[name]
+        recipe_ids = _select_recipe_ids(
+            sorted({name for _, names in projects.values() for name in names})
+        )
+        _insert_batched(Project, [dict(name=name) for name in projects])
+        project_ids = {}
+        for batch in peewee.chunked(list(projects), IN_QUERY_BATCH_SIZE):
+            query = Project.select(Project.id, Project.name).where(
+                Project.name.in_(batch)
+            )
+            project_ids.update((name, id_) for id_, name in query.tuples())
+        project_recipes = []
+        for name, (servings, recipe_names) in projects.items():
+            for recipe_name in recipe_names:
+                if recipe_name in recipe_ids:
+                    project_recipes.append(
+                        dict(
+                            project=project_ids[name],
+                            recipe=recipe_ids[recipe_name],
+                            servings=servings,
+                        )
+                    )
+                else:
+                    report.missing_recipes.setdefault(name, []).append(recipe_name)
+        _insert_batched(ProjectRecipe, project_recipes)
+    catalog.invalidate()
+    for name in projects:
+        logger.info(f"project created: {name}")
+        report.created.append(name)
+    return report
+
+
+# ------------------------- ingredients -------------------------
+
+
+def _ingredient_record(data) -> tuple[dict, list[str]]:
+    """Ingredient row and tag names from an `ingredient export` record"""
+    if not isinstance(data, dict) or "name" not in data or "unit" not in data:
+        raise ParsingError(f"name and unit required: {data!r}")
+    price = data.get("price")
+    row = dict(
+        name=normalize_string(str(data["name"])),
+        unit=Unit(data["unit"]),
+        price=float(price) if price is not None else None,
+    )
+    tags = [str(tag) for tag in data.get("tags") or []]
+    return row, tags
+
+
+def import_ingredients(records) -> IngredientImportReport:
+    """Upsert ingredients with their price and tags, as dumped by `Ingredient.dump`
+
+    Ingredients are matched on (name, unit). Existing ones get their price
+    updated when the record has one. Tags are created when missing, and
+    linked to their ingredients, existing links are kept.
+    """
+    report = IngredientImportReport()
+    rows, tags = {}, {}
+    for index, data in enumerate(records):
+        try:
+            row, tag_names = _ingredient_record(data)
+        except (ParsingError, ValueError, TypeError) as exc:
+            logger.warning(f"invalid ingredient record {index}: {exc}")
+            report.errors[index] = exc
+            continue
+        key = row["name"], row["unit"]
+        rows[key] = row
+        tags.setdefault(key, []).extend(tag_names)
+    with DB().atomic():
+        names = sorted({name for name, _ in rows})
+        existing = _select_ingredient_ids(names)
+        upsert = dict(
+            conflict_target=[Ingredient.name, Ingredient.unit],
+            update={
+                Ingredient.price: peewee.fn.COALESCE(
+                    peewee.EXCLUDED.price, Ingredient.price
+                )
+            },
+        )
+        for batch in peewee.chunked(list(rows.values()), INSERT_BATCH_SIZE):
+            Ingredient.insert_many(batch).on_conflict(**upsert).execute()
+        ids = _select_ingredient_ids(names)
+        tag_names = sorted({name for names in tags.values() for name in names})
+        tag_ids = _select_tag_ids(tag_names)
+        report.tags_created = [name for name in tag_names if name not in tag_ids]
+        _insert_batched(Tag, [dict(name=name) for name in report.tags_created])
+        tag_ids |= _select_tag_ids(report.tags_created)
+        links = [
+            dict(ingredient=ids[key], tag=tag_ids[name])
+            for key, names in tags.items()
+            for name in dict.fromkeys(names)
+        ]
+        for batch in peewee.chunked(links, INSERT_BATCH_SIZE):
+            IngredientTag.insert_many(batch).on_conflict_ignore().execute()
+    catalog.invalidate()
+    mark_all_stale()
+    for key in rows:
+        (report.updated if key in existing else report.created).append(key)
+    logger.info(
+        f"{len(report.created)} ingredients created, {len(report.updated)} updated"
+    )
+    return report
+
+
+def update_tags(records, create_tags=False) -> TagUpdateReport:
+    """Link ingredients to tags from `{name: ..., tags: [...]}` records
+
+    A record applies to all the units of an ingredient name. Tags that don't
+    exist are created with `create_tags`, reported as missing otherwise.
+    """
+    report = TagUpdateReport()
+    tags = defaultdict(list)
+    for record in records:
+        tags[normalize_string(str(record["name"]))].extend(record["tags"] or [])
+    with DB().atomic():
+        ingredient_ids = defaultdict(list)
+        for (name, _), id_ in _select_ingredient_ids(sorted(tags)).items():
+            ingredient_ids[name].append(id_)
+        tag_names = sorted(
+            {tag for record_tags in tags.values() for tag in record_tags}
+        )
+        tag_ids = _select_tag_ids(tag_names)
+        missing_tags = [name for name in tag_names if name not in tag_ids]
+        if create_tags:
+            _insert_batched(Tag, [dict(name=name) for name in missing_tags])
+            tag_ids |= _select_tag_ids(missing_tags)
+            report.tags_created = missing_tags
+        else:
+            report.missing_tags = missing_tags
+        existing = set()
+        ids = [id_ for name_ids in ingredient_ids.values() for id_ in name_ids]
+        for batch in peewee.chunked(ids, IN_QUERY_BATCH_SIZE):
+            query = IngredientTag.select(IngredientTag.ingredient, IngredientTag.tag)
+            existing.update(query.where(IngredientTag.ingredient.in_(batch)).tuples())
+        links = set()
+        for name, record_tags in tags.items():
+            if name not in ingredient_ids:
+                report.missing_ingredients.append(name)
+                continue
+            for id_ in ingredient_ids[name]:
+                links.update(
+                    (id_, tag_ids[tag]) for tag in record_tags if tag in tag_ids
+                )
+        report.skipped = len(links & existing)
+        new_links = sorted(links - existing)
+        for batch in peewee.chunked(new_links, INSERT_BATCH_SIZE):
+            IngredientTag.insert_many(
+                batch, fields=[IngredientTag.ingredient, IngredientTag.tag]
+            ).on_conflict_ignore().execute()
+        report.added = len(new_links)
+        tagged_ids = sorted({id_ for id_, _ in new_links})
+        for batch in peewee.chunked(tagged_ids, IN_QUERY_BATCH_SIZE):
+            mark_stale(projects_using_ingredients(batch))
+    catalog.invalidate()
+    return report
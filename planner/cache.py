@@ -0,0 +1,109 @@
+"""On-disk cache of parsed recipe files
+
+Entries are keyed by the file path, modification time and size, so an
+edited file is parsed again. Each entry is a small pickle file, the least
+recently used ones are evicted when the cache grows over its size.
+"""
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+from planner import logger
+from planner.config import config
+from planner.parse import Quantity, Unit, parse_recipe_file
+
+# bump when the output of the parser changes, to invalidate existing entries
+CACHE_VERSION = 1
+
+
+def _pack(parsed):
+    name, header, items, instructions = parsed
+    items = [
+        (quantity.number, str(quantity.unit), ingredient)
+        for quantity, ingredient in items
+    ]
+    return name, header, items, instructions
+
+
+def _unpack(packed):
+    name, header, items, instructions = packed
+    items = [
+        (Quantity(number, Unit(unit)), ingredient) for number, unit, ingredient in items
+    ]
+    return name, header, items, instructions
+
+
+class ParseCache:
+    """Cache of `parse_recipe_file` results, stored in a directory"""
+
+    def __init__(self, directory, max_entries=10_000):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            directory=config.get("parse_cache_dir", ".cache/recipes"),
+            max_entries=config.get("parse_cache_size", 10_000),
+        )
+
+    def _entry(self, path) -> Path:
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = f"{CACHE_VERSION}:{path}:{stat.st_mtime_ns}:{stat.st_size}"
+        return self.directory / hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, path):
+        """Parsed file from the cache, None if absent or unreadable"""
+        try:
+            entry = self._entry(path)
+            data = entry.read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            parsed = _unpack(pickle.loads(data))
+        except Exception:
+            # truncated, corrupted or in an older format, parsed again
+            logger.warning(f"dropping unreadable cache entry: {entry}")
+            entry.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+        os.utime(entry)  # mark as recently used
+        self.hits += 1
+        return parsed
+
+    def put(self, path, parsed) -> None:
+        entry = self._entry(path)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary = entry.with_suffix(".tmp")
+        temporary.write_bytes(
+            pickle.dumps(_pack(parsed), protocol=pickle.HIGHEST_PROTOCOL)
+        )
+        temporary.replace(entry)
+
+    def evict(self) -> None:
+        """Remove least recently used entries over the maximum size"""
+        try:
+            entries = list(self.directory.iterdir())
+        except FileNotFoundError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        evicted = entries[: len(entries) - self.max_entries]
+        for entry in evicted:
+            entry.unlink(missing_ok=True)
+        logger.debug(f"{len(evicted)} entries evicted from parse cache")
+
+    def parse_recipe_file(self, path):
+        """`parse_recipe_file` going through the cache"""
+        parsed = self.get(path)
+        if parsed is None:
+            parsed = parse_recipe_file(path)
+            self.put(path, parsed)
+        return parsed
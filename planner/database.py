@@ -2,6 +2,28 @@ import peewee
 
 from planner import logger
 from planner.config import config
+from planner.errors import ConfigurationError
+
+# pragmas set on each connection, by performance profile
+PROFILES = {
+    "default": {},
+    "fast": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64 * 1024,  # in KiB when negative, so 64MiB
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+        "foreign_keys": 1,
+    },
+}
+REPORTED_PRAGMAS = [
+    "journal_mode",
+    "synchronous",
+    "cache_size",
+    "mmap_size",
+    "temp_store",
+    "foreign_keys",
+]
 
 
 class DB:
@@ -21,8 +43,18 @@ class DB:
         else:
             db_url = config.get("database_file", "database.db")
             logger.debug(f"using database file: {db_url}")
-        return peewee.SqliteDatabase(db_url)
-        
+        profile = config.get("db_profile", "default")
+        try:
+            pragmas = PROFILES[profile]
+        except KeyError:
+            raise ConfigurationError(f"unknown database profile: {profile}")
+        logger.debug(f"using database profile: {profile}")
+        return peewee.SqliteDatabase(db_url, pragmas=pragmas)
+
+    @staticmethod
+    def pragmas() -> dict:
+        """Current value of the pragmas set by profiles"""
+        return {name: DB().pragma(name) for name in REPORTED_PRAGMAS}
 
     def __new__(cls):
         if not cls._instance:
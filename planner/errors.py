@@ -6,3 +6,6 @@ class QueryError(KitchenPlannerError):
 
 class ParsingError(KitchenPlannerError):
     ...
+
+class ConfigurationError(KitchenPlannerError):
+    ...
@@ -0,0 +1,230 @@
+"""Export shopping lists and projects to files
+
+Shopping list lines are written one at a time as they are read from the
+database, so memory stays constant whatever the size of the list.
+
+A project export loads all its recipes at once through the catalog, then
+renders recipe files from a thread pool. Files are written concurrently
+to a directory, or one after another to a single zip or tar archive.
+"""
+
+import csv
+import io
+import json
+import shutil
+import tarfile
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, TextIO
+
+from planner import logger
+from planner.logging import add_file_sink
+
+if TYPE_CHECKING:
+    # models are imported on use, the CLI reads the formats below at startup
+    from planner.models import Project, ShoppingLine
+
+FORMATS = ["csv", "tsv", "jsonl"]
+FIELDS = ["ingredient", "quantity", "unit", "category"]
+ARCHIVE_FORMATS = ["zip", "tar"]
+SUMMARY_FILE = "summary.txt"
+SHOPPING_LIST_FILE = "shopping_list.csv"
+LOG_FILE = Path("logs.txt")
+
+
+def _write_table(lines, file, dialect) -> int:
+    writer = csv.writer(file, dialect=dialect)
+    writer.writerow(FIELDS)
+    count = 0
+    for line in lines:
+        writer.writerow([line.name, f"{line.quantity:.1f}", line.unit, line.category])
+        count += 1
+    return count
+
+
+def _write_json_lines(lines, file) -> int:
+    count = 0
+    for line in lines:
+        row = dict(zip(FIELDS, [line.name, line.quantity, line.unit, line.category]))
+        file.write(json.dumps(row) + "\n")
+        count += 1
+    return count
+
+
+def write_shopping_list(
+    lines: Iterable["ShoppingLine"], file: TextIO, format="csv"
+) -> int:
+    """Write shopping lines to an open text file, return the number of lines
+
+    CSV and TSV files have a header and quantities rounded like the tables,
+    JSON Lines have one object per line with the exact quantity.
+    """
+    match format:
+        case "csv":
+            return _write_table(lines, file, csv.excel)
+        case "tsv":
+            return _write_table(lines, file, csv.excel_tab)
+        case "jsonl":
+            return _write_json_lines(lines, file)
+        case _:
+            raise ValueError(f"unknown export format: {format!r}")
+
+
+# ------------------------- project -------------------------
+
+
+def _summary_text(project: "Project") -> str:
+    from rich.console import Console
+
+    file = io.StringIO()
+    Console(file=file).print(project.detail_printable())
+    return file.getvalue()
+
+
+def _recipe_file_names(items) -> list[str]:
+    """Unique file names of the recipes of a project
+
+    A recipe used more than once is told apart by its servings, then by a
+    number when servings are the same too.
+    """
+    stems = [Path(item.recipe.name).with_suffix("").name for item in items]
+    counts = Counter(stems)
+    names, used = [], set()
+    for item, stem in zip(items, stems):
+        if counts[stem] > 1:
+            stem = f"{stem} ({item.servings})"
+        name, number = f"{stem}.txt", 2
+        while name in used:
+            name, number = f"{stem} {number}.txt", number + 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def _render_recipe_files(project: "Project", jobs) -> list[tuple[str, str]]:
+    """Scaled recipe texts of a project, as `(file name, text)`"""
+    from planner.models import catalog
+
+    items = catalog.project_items(project.id)  # recipes, items and ingredients
+
+    def render(item):
+        return item.recipe.as_text(servings=item.servings)
+
+    with ThreadPoolExecutor(jobs) as executor:
+        return list(zip(_recipe_file_names(items), executor.map(render, items)))
+
+
+class _DirectoryWriter:
+    """Write the files of a directory from a thread pool"""
+
+    def __init__(self, path: Path, jobs) -> None:
+        path.mkdir(parents=True)
+        self.path = path
+        self._executor = ThreadPoolExecutor(jobs)
+        self._futures = []
+
+    def write(self, name, text) -> None:
+        self._futures.append(self._executor.submit((self.path / name).write_text, text))
+
+    @contextmanager
+    def open(self, name):
+        with (self.path / name).open("w", newline="") as file:
+            yield file
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        for future in self._futures:
+            future.result()  # raise errors of the writes
+
+
+class _ZipWriter:
+    """Write files as members of a zip archive"""
+
+    def __init__(self, path: Path, jobs) -> None:
+        self.root = path.name.removesuffix(".zip")
+        self._archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, name, text) -> None:
+        self._archive.writestr(f"{self.root}/{name}", text)
+
+    @contextmanager
+    def open(self, name):
+        info = zipfile.ZipInfo(f"{self.root}/{name}", time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with self._archive.open(info, "w") as binary:
+            file = io.TextIOWrapper(binary, encoding="utf-8", newline="")
+            yield file
+            file.flush()
+
+    def close(self) -> None:
+        self._archive.close()
+
+
+class _TarWriter:
+    """Write files as members of a tar archive"""
+
+    def __init__(self, path: Path, jobs) -> None:
+        self.root = path.name.removesuffix(".tar")
+        self._archive = tarfile.open(path, "w")
+
+    def write(self, name, text) -> None:
+        data = text.encode()
+        info = tarfile.TarInfo(f"{self.root}/{name}")
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._archive.addfile(info, io.BytesIO(data))
+
+    @contextmanager
+    def open(self, name):
+        # tar members need their size upfront, so the file is buffered
+        file = io.StringIO(newline="")
+        yield file
+        self.write(name, file.getvalue())
+
+    def close(self) -> None:
+        self._archive.close()
+
+
+WRITERS = {None: _DirectoryWriter, "zip": _ZipWriter, "tar": _TarWriter}
+
+
+def export_project(project: "Project", target, archive=None, jobs=4) -> Path:
+    """Write summary, shopping list, scaled recipes and logs of a project
+
+    Files go to the `target` directory, or to a `target.zip` or `target.tar`
+    archive when `archive` is set, replacing an earlier export. Return the
+    path written.
+    """
+    try:
+        writer_class = WRITERS[archive]
+    except KeyError:
+        raise ValueError(f"unknown archive format: {archive!r}")
+    target = Path(target)
+    if archive is not None:
+        target = target.with_name(f"{target.name}.{archive}")
+    if target.is_dir():
+        logger.info(f"deleting directory: {target}")
+        shutil.rmtree(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    writer = writer_class(target, jobs)
+    try:
+        file_sink = add_file_sink()
+        try:
+            writer.write(SUMMARY_FILE, _summary_text(project))
+            with writer.open(SHOPPING_LIST_FILE) as file:
+                write_shopping_list(project.iter_shopping_lines(), file)
+            for name, text in _render_recipe_files(project, jobs):
+                writer.write(name, text)
+        finally:
+            logger.remove(file_sink)
+        # logs of the export are part of it
+        if LOG_FILE.exists():
+            writer.write(LOG_FILE.name, LOG_FILE.read_text())
+    finally:
+        writer.close()
+    logger.debug(f"project exported to {target}")
+    return target
@@ -21,10 +21,10 @@ def add_terminal_sink():
     )
 
 
-def add_file_sink():
-    """Setup a free text logging sink to stdout"""
+def add_file_sink() -> int:
+    """Setup a free text logging sink to logs.txt, return its id"""
     level = config.get("logging_level", default=DEFAULT_LOGGING_LEVEL).upper()
-    logger.add(
+    return logger.add(
         "logs.txt",
         format="{message}",
         level=level,
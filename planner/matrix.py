@@ -0,0 +1,216 @@
+"""Shopping lists as products of a recipe x ingredient quantity matrix
+
+Recipe items are loaded once into a sparse CSR matrix, one row per recipe
+and one column per ingredient. A project is a row of scaling factors
+(servings / serves) over recipes, its shopping list the product of that
+row with the matrix. A batch of projects is a sparse scaling matrix, all
+their lists come from a single matrix-matrix product. Units of an
+ingredient are then merged like `Project.shopping_list` does.
+"""
+
+from typing import Self
+
+import numpy as np
+import peewee
+from scipy import sparse
+
+from planner import logger
+from planner.models import (
+    Ingredient,
+    IngredientConversion,
+    ProjectRecipe,
+    Recipe,
+    RecipeItem,
+    merge_units,
+)
+
+
+class RecipeMatrix:
+    """Sparse recipe x ingredient quantity matrix
+
+    `first_items` has the structure of `quantities`, with the smallest item
+    id of each entry, to sort lists like the shopping list query does.
+    """
+
+    def __init__(
+        self, quantities, first_items, recipe_ids, serves, ingredients
+    ) -> None:
+        self.quantities = quantities  # csr_array, recipes x ingredients
+        self.first_items = first_items  # csr_array, recipes x ingredients
+        self.rows = {recipe_id: row for row, recipe_id in enumerate(recipe_ids)}
+        self.serves = serves  # persons served, per row
+        self.ingredients = ingredients  # Ingredient, density and unit weight set
+        self.columns = np.array([ingredient.id for ingredient in ingredients])
+
+    @classmethod
+    def load(cls, recipes=None) -> Self:
+        """Load items of `recipes`, a query or list of ids, or of all recipes"""
+        items = (
+            RecipeItem.select(
+                RecipeItem.recipe,
+                Recipe.serves,
+                RecipeItem.ingredient,
+                RecipeItem.quantity,
+                RecipeItem.id,
+            )
+            .join(Recipe)
+            .order_by(RecipeItem.recipe, RecipeItem.ingredient, RecipeItem.id)
+        )
+        ingredients = (
+            Ingredient.select(
+                Ingredient,
+                IngredientConversion.density,
+                IngredientConversion.unit_weight,
+            )
+            .join(
+                IngredientConversion,
+                peewee.JOIN.LEFT_OUTER,
+                on=(IngredientConversion.name == Ingredient.name),
+            )
+            .order_by(Ingredient.id)
+        )
+        if recipes is not None:
+            items = items.where(RecipeItem.recipe.in_(recipes))
+            ingredients = ingredients.where(
+                Ingredient.id.in_(
+                    RecipeItem.select(RecipeItem.ingredient).where(
+                        RecipeItem.recipe.in_(recipes)
+                    )
+                )
+            )
+        ingredients = list(ingredients.objects())
+        table = np.array(list(items.tuples()), dtype=float).reshape(-1, 5)
+        recipe_ids, serves, ingredient_ids, item_ids = (
+            table[:, column].astype(np.int64) for column in (0, 1, 2, 4)
+        )
+        quantities = table[:, 3]
+        recipe_ids, row_index = np.unique(recipe_ids, return_inverse=True)
+        column_index = np.searchsorted(
+            np.array([ingredient.id for ingredient in ingredients]), ingredient_ids
+        )
+        # items are sorted by recipe then ingredient, entries of an ingredient
+        # used twice in a recipe are summed
+        starts = np.flatnonzero(
+            np.diff(row_index, prepend=-1) | np.diff(column_index, prepend=-1)
+        )
+        shape = (len(recipe_ids), len(ingredients))
+        coordinates = (row_index[starts], column_index[starts])
+        matrix = sparse.csr_array(
+            (np.add.reduceat(quantities, starts), coordinates), shape=shape
+        )
+        first_items = sparse.csr_array(
+            (np.minimum.reduceat(item_ids, starts), coordinates), shape=shape
+        )
+        recipe_serves = np.zeros(len(recipe_ids))
+        recipe_serves[row_index] = serves
+        logger.debug(
+            f"recipe matrix loaded: {shape[0]} recipes x {shape[1]} ingredients"
+        )
+        return cls(matrix, first_items, recipe_ids.tolist(), recipe_serves, ingredients)
+
+    def scaling(self, servings_batch) -> sparse.csr_array:
+        """Scaling matrix, projects x recipes, from `(recipe id, servings)` pairs
+
+        Recipes without items, so not in the matrix, are left out.
+        """
+        projects, rows, factors = [], [], []
+        for project, servings in enumerate(servings_batch):
+            for recipe_id, recipe_servings in servings:
+                if (row := self.rows.get(recipe_id)) is not None:
+                    projects.append(project)
+                    rows.append(row)
+                    factors.append(recipe_servings)
+        rows = np.array(rows, dtype=np.int64)
+        factors = np.array(factors, dtype=float) / self.serves[rows]
+        shape = (project + 1 if servings_batch else 0, len(self.rows))
+        return sparse.csr_array((factors, (projects, rows)), shape=shape)
+
+    def _ordered_columns(self, rows) -> np.ndarray:
+        """Columns used by recipe `rows`, in the order of the shopping list query
+
+        First recipe using the ingredient, then its first item id, `rows`
+        being in the order recipes were added to the project.
+        """
+        used = self.first_items[rows]  # one row per recipe of the project
+        positions = np.repeat(np.arange(len(rows)), np.diff(used.indptr))
+        first_position = np.full(len(self.ingredients), len(rows))
+        first_item = np.full(len(self.ingredients), np.iinfo(np.int64).max)
+        np.minimum.at(first_position, used.indices, positions)
+        np.minimum.at(first_item, used.indices, used.data)
+        columns = np.unique(used.indices)
+        return columns[np.lexsort((first_item[columns], first_position[columns]))]
+
+    def _merged_list(self, columns, quantities) -> list[tuple[Ingredient, float]]:
+        rows = [
+            dict(
+                id=ingredient.id,
+                name=ingredient.name,
+                unit=ingredient.unit,
+                price=ingredient.price,
+                scaled_quantity=quantity,
+                item_count=1,
+                density=ingredient.density,
+                unit_weight=ingredient.unit_weight,
+            )
+            for ingredient, quantity in zip(
+                (self.ingredients[column] for column in columns), quantities.tolist()
+            )
+        ]
+        return [
+            (
+                Ingredient(
+                    id=row["id"], name=row["name"], unit=row["unit"], price=row["price"]
+                ),
+                row["scaled_quantity"],
+            )
+            for row in merge_units(rows)
+        ]
+
+    def shopping_lists(self, servings_batch) -> list[list[tuple[Ingredient, float]]]:
+        """Shopping lists from `(recipe id, servings)` pairs of many projects"""
+        servings_batch = list(servings_batch)
+        scaling = self.scaling(servings_batch)
+        products = scaling @ self.quantities  # projects x ingredients
+        lists = []
+        for project, servings in enumerate(servings_batch):
+            rows = [
+                self.rows[recipe_id]
+                for recipe_id, _ in servings
+                if recipe_id in self.rows
+            ]
+            columns = self._ordered_columns(np.array(rows, dtype=np.int64))
+            quantities = products[[project]].toarray()[0][columns]
+            lists.append(self._merged_list(columns, quantities))
+        return lists
+
+    def shopping_list(self, servings) -> list[tuple[Ingredient, float]]:
+        """Shopping list from `(recipe id, servings)` pairs, units merged"""
+        return self.shopping_lists([servings])[0]
+
+
+def project_servings(projects) -> dict[int, list[tuple[int, int]]]:
+    """Map project ids to their `(recipe id, servings)` pairs"""
+    servings = {project.id: [] for project in projects}
+    query = (
+        ProjectRecipe.select(
+            ProjectRecipe.project, ProjectRecipe.recipe, ProjectRecipe.servings
+        )
+        .where(ProjectRecipe.project.in_(list(servings)))
+        .order_by(ProjectRecipe.id)
+        .tuples()
+    )
+    for project_id, recipe_id, recipe_servings in query:
+        servings[project_id].append((recipe_id, recipe_servings))
+    return servings
+
+
+def shopping_lists(projects) -> list[list[tuple[Ingredient, float]]]:
+    """Shopping lists of many projects, loading their recipes once"""
+    projects = list(projects)
+    servings = project_servings(projects)
+    matrix = RecipeMatrix.load(
+        ProjectRecipe.select(ProjectRecipe.recipe).where(
+            ProjectRecipe.project.in_(list(servings))
+        )
+    )
+    return matrix.shopping_lists(servings[project.id] for project in projects)
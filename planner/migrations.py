@@ -0,0 +1,158 @@
+"""Versioned schema migrations of database files
+
+The schema version is the highest version recorded in the `schema_version`
+table, 0 for databases made before migrations. Migrations run in order,
+each one recorded once done, so an interrupted upgrade resumes where it
+stopped. A new database is created at the latest version directly.
+
+Index migrations build each index in its own short statement instead of a
+transaction around the whole migration. In WAL mode, readers keep working
+while an index is built, and writers only wait for the one being built.
+"""
+
+import datetime
+import time
+from typing import Callable, NamedTuple
+
+import peewee
+
+from planner import logger
+from planner.database import DB
+from planner.models import (
+    IngredientConversion,
+    IngredientTag,
+    ProjectRecipe,
+    ProjectShoppingLine,
+    ProjectShoppingListStatus,
+    RecipeItem,
+    RecipeSource,
+    all_models,
+)
+
+
+class SchemaVersion(peewee.Model):
+    """A migration applied to the database"""
+
+    version = peewee.IntegerField(primary_key=True)
+    name = peewee.CharField()
+    applied_at = peewee.DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        database = DB()
+        table_name = "schema_version"
+
+
+class Migration(NamedTuple):
+    version: int
+    function: Callable[[], None]
+    atomic: bool = True  # run in a single transaction
+
+    @property
+    def name(self) -> str:
+        return self.function.__name__
+
+
+def create_index_online(model, *fields, unique=False) -> None:
+    """Build an index, if missing, in its own statement"""
+    index = model.index(*fields, unique=unique).safe()
+    start = time.perf_counter()
+    DB().execute(index)
+    logger.debug(f"index {index._name} built in {time.perf_counter() - start:.2f}s")
+
+
+def drop_index(name) -> None:
+    DB().execute_sql(f'DROP INDEX IF EXISTS "{name}"')
+
+
+# ------------------------- migrations -------------------------
+
+
+def add_recipe_sources() -> None:
+    DB().create_tables([RecipeSource])
+
+
+def add_ingredient_conversions() -> None:
+    DB().create_tables([IngredientConversion])
+
+
+def add_materialized_shopping_lists() -> None:
+    DB().create_tables([ProjectShoppingLine, ProjectShoppingListStatus])
+
+
+def add_covering_indexes() -> None:
+    create_index_online(IngredientTag, IngredientTag.tag, IngredientTag.ingredient)
+    create_index_online(
+        RecipeItem, RecipeItem.recipe, RecipeItem.ingredient, RecipeItem.quantity
+    )
+    create_index_online(RecipeItem, RecipeItem.ingredient, RecipeItem.recipe)
+    create_index_online(
+        ProjectRecipe,
+        ProjectRecipe.project,
+        ProjectRecipe.recipe,
+        ProjectRecipe.servings,
+    )
+    create_index_online(ProjectRecipe, ProjectRecipe.recipe, ProjectRecipe.project)
+    # single column indexes covered by the ones above
+    for name in [
+        "ingredienttag_ingredient_id",
+        "ingredienttag_tag_id",
+        "recipeitem_ingredient_id",
+        "recipeitem_recipe_id",
+        "projectrecipe_project_id",
+        "projectrecipe_recipe_id",
+        "projectshoppingline_project_id",
+    ]:
+        drop_index(name)
+
+
+def drop_shopping_list() -> None:
+    """Unused table of a removed model"""
+    DB().execute_sql('DROP TABLE IF EXISTS "shoppinglist"')
+
+
+MIGRATIONS = [
+    Migration(1, add_recipe_sources),
+    Migration(2, add_ingredient_conversions),
+    Migration(3, add_materialized_shopping_lists),
+    Migration(4, add_covering_indexes, atomic=False),
+    Migration(5, drop_shopping_list),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# ------------------------- migrate -------------------------
+
+
+def current_version() -> int:
+    return SchemaVersion.select(peewee.fn.MAX(SchemaVersion.version)).scalar() or 0
+
+
+def _record(migration: Migration) -> None:
+    SchemaVersion.insert(
+        version=migration.version, name=migration.name
+    ).on_conflict_replace().execute()
+
+
+def migrate() -> list[Migration]:
+    """Bring the database to the latest version, return migrations applied"""
+    SchemaVersion.create_table()
+    if set(DB().get_tables()) == {SchemaVersion._meta.table_name}:
+        with DB().atomic():
+            DB().create_tables(all_models)
+            for migration in MIGRATIONS:
+                _record(migration)
+        logger.info(f"database created at version {LATEST_VERSION}")
+        return []
+    version = current_version()
+    pending = [migration for migration in MIGRATIONS if migration.version > version]
+    for migration in pending:
+        logger.info(f"migrating to version {migration.version}: {migration.name}")
+        if migration.atomic:
+            with DB().atomic():
+                migration.function()
+                _record(migration)
+        else:
+            migration.function()
+            _record(migration)
+    logger.debug(f"database at version {LATEST_VERSION}")
+    return pending
@@ -1,32 +1,57 @@
+import datetime
 from collections import defaultdict
-from typing import Self
+from typing import Iterator, NamedTuple, Self
 
 import funcy
 import peewee
-from prettytable import PrettyTable
-from rich import print
-from rich.console import Group
-from rich.panel import Panel
-from rich.text import Text
 
 from planner import logger
 from planner.database import DB
 from planner.errors import QueryError
-from planner.logging import add_file_sink
-from planner.parse import Unit, normalize_string, parse_recipe_file
+from planner.parse import Unit, base_unit, normalize_string, parse_recipe_file
+
+# keep `IN (...)` clauses under SQLite's bound parameters limit
+IN_QUERY_BATCH_SIZE = 500
+# rows per INSERT statement, keeps bound parameters under SQLite's limit
+INSERT_BATCH_SIZE = 100
 
 
 class BaseModel(peewee.Model):
     class Meta:
         database = DB()
 
+    # new rows of link models change the shopping lists of existing projects,
+    # new entities (tags, ingredients, recipes, projects) have no dependents
+    _stale_on_insert = False
+
+    def save(self, *args, **kwargs):
+        catalog.invalidate()
+        if self._pk is None or kwargs.get("force_insert", False):
+            changed = self._stale_on_insert
+        else:
+            changed = bool(self.dirty_fields)
+        saved = super().save(*args, **kwargs)
+        if changed and (projects := self._affected_projects()) is not None:
+            mark_stale(projects)
+        return saved
+
+    def delete_instance(self, *args, **kwargs):
+        catalog.invalidate()
+        if (projects := self._affected_projects()) is not None:
+            mark_stale(projects)
+        return super().delete_instance(*args, **kwargs)
+
+    def _affected_projects(self):
+        """Ids of the projects whose shopping list depends on this record"""
+        return None
+
 
 class UnitField(peewee.CharField):
     def db_value(self, unit: Unit):
-        return str(unit)
+        return str(unit) if unit is not None else None
 
     def python_value(self, value):
-        return Unit(value)
+        return Unit(value) if value is not None else None
 
 
 class Tag(BaseModel):
@@ -40,6 +65,13 @@ class Tag(BaseModel):
     def __repr__(self) -> str:
         return f"<Tag({self.name!r})>"
 
+    def _affected_projects(self):
+        return projects_using_ingredients(
+            IngredientTag.select(IngredientTag.ingredient).where(
+                IngredientTag.tag == self.id
+            )
+        )
+
 
 class Ingredient(BaseModel):
     """Ingredient to be used in recipes. Have a fixed unit of count and price"""
@@ -59,6 +91,7 @@ class Ingredient(BaseModel):
         if (name := kwargs.get("name")) is not None:
             kwargs["name"] = normalize_string(name)
         super().__init__(**kwargs)
+        self._tags = None  # set by prefetch_tags
 
     def __str__(self) -> str:
         return str(self.name)
@@ -70,20 +103,45 @@ class Ingredient(BaseModel):
     def exists(cls, name) -> bool:
         return cls.get_or_none(cls.name == name) is not None
 
+    def _affected_projects(self):
+        return projects_using_ingredients([self.id])
+
     def add_tag(self, tag: Tag):
         try:
             IngredientTag.create(ingredient=self, tag=tag)
         except peewee.IntegrityError:
             logger.warning(f"tag already existed on {self.name}: {tag.name}")
+        self._tags = None
+
+    @classmethod
+    def prefetch_tags(cls, ingredients) -> list[Self]:
+        """Load tags of many ingredients at once
+
+        Tags are attached to the instances, so that `tags`, `category` and
+        `dump` don't query the database anymore.
+        """
+        ingredients = list(ingredients)
+        tags = defaultdict(list)
+        for batch in peewee.chunked(ingredients, IN_QUERY_BATCH_SIZE):
+            links = (
+                IngredientTag.select(IngredientTag.ingredient, Tag)
+                .join(Tag)
+                .where(IngredientTag.ingredient.in_([i.id for i in batch]))
+                .order_by(IngredientTag.id)
+            )
+            for link in links:
+                tags[link.ingredient_id].append(link.tag)
+        for ingredient in ingredients:
+            ingredient._tags = tags[ingredient.id]
+        return ingredients
 
     @property
     def tags(self):
-        return list(
-            Tag.select()
-            .join(IngredientTag)
-            .join(Ingredient)
-            .where(Ingredient.id == self.id)
-        )
+        if self._tags is not None:
+            return list(self._tags)
+        if self.id is None:
+            return []
+        return catalog.ingredient(self.id).tags
 
     @property
     def category(self):
@@ -95,6 +153,48 @@ class Ingredient(BaseModel):
         else:
             return "usual"
 
+    @classmethod
+    def category_expression(cls):
+        """SQL expression of `category`, to compute it in a query"""
+
+        def has_tag(name):
+            return peewee.fn.EXISTS(
+                IngredientTag.select(IngredientTag.id)
+                .join(Tag)
+                .where((IngredientTag.ingredient == cls.id) & (Tag.name == name))
+            )
+
+        return peewee.Case(
+            None,
+            [(has_tag("uncommon"), "uncommon"), (has_tag("fresh"), "fresh")],
+            "usual",
+        )
+
+    @classmethod
+    def listing(cls, after=0, limit=None):
+        """Rows of id, name, unit, price, tags and category, ordered by id
+
+        Tags are joined in a comma separated string. Rows start after the
+        id `after`, for keyset pagination.
+        """
+        return (
+            cls.select(
+                cls.id,
+                cls.name,
+                cls.unit,
+                cls.price,
+                peewee.fn.GROUP_CONCAT(Tag.name, ", ").alias("tags"),
+                cls.category_expression().alias("category"),
+            )
+            .join(IngredientTag, peewee.JOIN.LEFT_OUTER)
+            .join(Tag, peewee.JOIN.LEFT_OUTER)
+            .where(cls.id > after)
+            .group_by(cls.id)
+            .order_by(cls.id)
+            .limit(limit)
+            .tuples()
+        )
+
     def dump(self) -> dict:
         dump_ = dict(
             name=self.name, unit=str(self.unit), tags=[str(tag) for tag in self.tags]
@@ -104,14 +204,47 @@ class Ingredient(BaseModel):
         return dump_
 
 
+class IngredientConversion(BaseModel):
+    """Conversion of an ingredient between units, for all its units"""
+
+    name = peewee.CharField(unique=True)
+    density = peewee.FloatField(null=True)  # kg per liter
+    unit_weight = peewee.FloatField(null=True)  # kg per unit
+
+    def __init__(self, **kwargs) -> None:
+        if "name" in kwargs:
+            kwargs["name"] = normalize_string(kwargs["name"])
+        super().__init__(**kwargs)
+
+    def __repr__(self) -> str:
+        return f"<IngredientConversion({self.name!r})>"
+
+    def _affected_projects(self):
+        return projects_using_ingredients(
+            Ingredient.select(Ingredient.id).where(Ingredient.name == self.name)
+        )
+
+    def save(self, *args, **kwargs):
+        created = self.id is None
+        saved = super().save(*args, **kwargs)
+        if created and (self.density, self.unit_weight) != (None, None):
+            mark_stale(self._affected_projects())
+        return saved
+
+
 class IngredientTag(BaseModel):
     """Link ingredients to tags"""
 
-    ingredient = peewee.ForeignKeyField(Ingredient)
-    tag = peewee.ForeignKeyField(Tag)
+    ingredient = peewee.ForeignKeyField(Ingredient, index=False)
+    tag = peewee.ForeignKeyField(Tag, index=False)
+    _stale_on_insert = True
 
     class Meta:
-        indexes = [(("ingredient", "tag"), True)]
+        # tags of an ingredient, and ingredients of a tag
+        indexes = [(("ingredient", "tag"), True), (("tag", "ingredient"), False)]
+
+    def _affected_projects(self):
+        return projects_using_ingredients([self.ingredient_id])
 
 
 class Recipe(BaseModel):
@@ -131,16 +264,26 @@ class Recipe(BaseModel):
     def __str__(self) -> str:
         return f"{self.name} ({self.serves} persons)"
 
+    def _affected_projects(self):
+        return projects_using_recipes([self.id])
+
     @property
     def item_section(self) -> str:
         description_ = [str(self)]
-        for item in getattr(self, "items"):
+        for item in catalog.items(self.id):
             description_.append(
                 f"- {item.quantity} {item.ingredient.unit} {item.ingredient.name}"
             )
         return "\n".join(description_)
 
     def add_item(self, quantity, name) -> Self:
+        item = self._new_item(quantity, name)
+        item.save()
+        logger.debug(f"recipe item created: {item}")
+        return item
+
+    def _new_item(self, quantity, name) -> "RecipeItem":
+        """Unsaved item, its ingredient created if needed"""
         ingredient, created = Ingredient.get_or_create(
             name=name, unit=str(quantity.unit)
         )
@@ -148,11 +291,7 @@ class Recipe(BaseModel):
             logger.debug(f"new ingredient created: {ingredient}")
         else:
             logger.debug("ingredient found in database")
-        item = RecipeItem.create(
-            ingredient=ingredient, quantity=quantity.number, recipe=self
-        )
-        logger.debug(f"recipe item created: {item}")
-        return item
+        return RecipeItem(ingredient=ingredient, quantity=quantity.number, recipe=self)
 
     @classmethod
     def create_from_file(cls, path):
@@ -165,8 +304,11 @@ class Recipe(BaseModel):
             recipe = Recipe.create(
                 name=name, serves=header["serves"], instructions=instructions
             )
-            for quantity, name in items:
-                recipe.add_item(quantity, name)
+            # no project uses the new recipe, items don't mark any stale
+            RecipeItem.bulk_create(
+                [recipe._new_item(quantity, name) for quantity, name in items]
+            )
+            catalog.invalidate()
         logger.info(f"recipe created: {recipe.name}")
         return recipe
 
@@ -182,7 +324,7 @@ class Recipe(BaseModel):
             scaling_factor = 1
         yield f"serves: {self.serves * scaling_factor}"
         yield "---"
-        for item in self.items:
+        for item in catalog.items(self.id):
             yield f"- {item.quantity * scaling_factor:.3f} {item.ingredient.unit} {item.ingredient}"
         if self.instructions is not None:
             yield "---"
@@ -192,7 +334,7 @@ class Recipe(BaseModel):
 class IngredientQuantity(BaseModel):
     """An item of a recipe. Ingredient and Quantity"""
 
-    ingredient = peewee.ForeignKeyField(Ingredient)
+    ingredient = peewee.ForeignKeyField(Ingredient, index=False)
     quantity = peewee.FloatField()
 
     def __str__(self) -> str:
@@ -202,7 +344,53 @@ class IngredientQuantity(BaseModel):
 class RecipeItem(IngredientQuantity):
     """An item of a recipe. Ingredient and Quantity"""
 
-    recipe = peewee.ForeignKeyField(Recipe, backref="items")
+    recipe = peewee.ForeignKeyField(Recipe, backref="items", index=False)
+    _stale_on_insert = True
+
+    class Meta:
+        # items of a recipe read from the index alone, recipes of an ingredient
+        indexes = [
+            (("recipe", "ingredient", "quantity"), False),
+            (("ingredient", "recipe"), False),
+        ]
+
+    def _affected_projects(self):
+        return projects_using_recipes([self.recipe_id])
+
+
+class RecipeSource(BaseModel):
+    """File a recipe was loaded from, with a hash of its content"""
+
+    recipe = peewee.ForeignKeyField(Recipe, unique=True)
+    path = peewee.CharField(unique=True)
+    content_hash = peewee.CharField()
+
+
+class ShoppingLine(NamedTuple):
+    """A line of a computed shopping list, detached from the database"""
+
+    ingredient_id: int
+    name: str
+    unit: Unit
+    category: str
+    quantity: float
+    price: float | None  # per unit
+
+    @classmethod
+    def from_row(cls, row) -> Self:
+        """Line from a row of the shopping list query, as a dict"""
+        return cls(
+            ingredient_id=row["id"],
+            name=row["name"],
+            unit=row["unit"],
+            category=row["category"],
+            quantity=row["scaled_quantity"],
+            price=row["price"],
+        )
+
+    @property
+    def cost(self) -> float | None:
+        return self.price * self.quantity if self.price is not None else None
 
 
 class Project(BaseModel):
@@ -213,7 +401,7 @@ class Project(BaseModel):
     _list_fields = ["id", "name", ("items", len)]
 
     def __str__(self) -> str:
-        return f"{self.name}: {funcy.ilen(self.items)} recipes"
+        return f"{self.name}: {len(catalog.project_items(self.id))} recipes"
 
     def __repr__(self) -> str:
         return f"Project(name={self.name})"
@@ -236,25 +424,149 @@ class Project(BaseModel):
 
     # --- compute shopping list
 
-    def shopping_list(self):
-        shopping_list = defaultdict(float)
-        items_before_aggregation = 0
-        for project_recipe in self.items:
-            scaling_factor = project_recipe.servings / project_recipe.recipe.serves
-            logger.debug(
-                f"========  {project_recipe.recipe} scaled from {project_recipe.recipe.serves} to {project_recipe.servings} (x{scaling_factor:.2f}). {len(project_recipe.recipe.items)} items"
+    def _shopping_list_query(self, servings=None):
+        """Aggregate scaled recipe items of the project, grouped by ingredient"""
+        if servings is None:
+            servings = ProjectRecipe.servings
+        scaled_quantity = RecipeItem.quantity * servings / Recipe.serves
+        return (
+            Ingredient.select(
+                Ingredient,
+                peewee.fn.SUM(scaled_quantity).alias("scaled_quantity"),
+                peewee.fn.COUNT(RecipeItem.id).alias("item_count"),
+                IngredientConversion.density,
+                IngredientConversion.unit_weight,
             )
-            for ingredient_quantity in project_recipe.recipe.items:
-                items_before_aggregation += 1
-                scaled_quantity = ingredient_quantity.quantity * scaling_factor
-                logger.debug(
-                    f"{ingredient_quantity.ingredient.name}: {scaled_quantity:.2f} {ingredient_quantity.ingredient.unit}"
-                )
-                shopping_list[ingredient_quantity.ingredient] += scaled_quantity
-        logger.info(
-            f"aggregation reduced item list from {items_before_aggregation} to {len(shopping_list)}"
+            .join(RecipeItem)
+            .join(Recipe)
+            .join(ProjectRecipe, on=(ProjectRecipe.recipe == Recipe.id))
+            .join_from(
+                Ingredient,
+                IngredientConversion,
+                peewee.JOIN.LEFT_OUTER,
+                on=(IngredientConversion.name == Ingredient.name),
+            )
+            .where(ProjectRecipe.project == self)
+            .group_by(Ingredient.id)
+            # keep ingredients in order of first appearance in the project
+            .order_by(peewee.fn.MIN(ProjectRecipe.id), peewee.fn.MIN(RecipeItem.id))
+            .dicts()
         )
-        return funcy.lmap(tuple, shopping_list.items())
+
+    def shopping_list(self, servings=None):
+        """Ingredients and quantities for all the recipes of the project
+
+        With `servings`, every recipe is scaled to that number of persons
+        instead of its own servings. Units of an ingredient are merged, see
+        `merge_units`.
+        """
+        return [
+            (
+                Ingredient(
+                    id=line.ingredient_id,
+                    name=line.name,
+                    unit=line.unit,
+                    price=line.price,
+                ),
+                line.quantity,
+            )
+            for line in self.shopping_lines(servings)
+        ]
+
+    def _shopping_lines_query(self, servings=None):
+        return self._shopping_list_query(servings).select_extend(
+            Ingredient.category_expression().alias("category")
+        )
+
+    def _compute_shopping_lines(self, servings=None) -> list[ShoppingLine]:
+        rows = merge_units(self._shopping_lines_query(servings))
+        _log_aggregation(sum(row["item_count"] for row in rows), len(rows))
+        return [ShoppingLine.from_row(row) for row in rows]
+
+    def _materialized_lines_query(self):
+        return ProjectShoppingLine.select(
+            ProjectShoppingLine.ingredient.alias("id"),
+            ProjectShoppingLine.name,
+            ProjectShoppingLine.unit,
+            ProjectShoppingLine.category,
+            ProjectShoppingLine.quantity.alias("scaled_quantity"),
+            ProjectShoppingLine.price,
+        ).where(ProjectShoppingLine.project == self)
+
+    def _materialize(self, lines) -> None:
+        rows = [
+            dict(
+                project=self,
+                position=position,
+                ingredient=line.ingredient_id,
+                name=line.name,
+                unit=line.unit,
+                category=line.category,
+                quantity=line.quantity,
+                price=line.price,
+            )
+            for position, line in enumerate(lines)
+        ]
+        with DB().atomic():
+            ProjectShoppingLine.delete().where(
+                ProjectShoppingLine.project == self
+            ).execute()
+            for batch in peewee.chunked(rows, INSERT_BATCH_SIZE):
+                ProjectShoppingLine.insert_many(batch).execute()
+            ProjectShoppingListStatus.insert(
+                project=self, computed_at=datetime.datetime.now()
+            ).on_conflict_replace().execute()
+        logger.debug(f"shopping list of {self.name!r} materialized")
+
+    def _stored_lines_query(self):
+        # a status row without lines is an up to date empty list
+        return (
+            ProjectShoppingListStatus.select(
+                ProjectShoppingListStatus.id.alias("status"),
+                *self._materialized_lines_query().selected_columns,
+            )
+            .join(
+                ProjectShoppingLine,
+                peewee.JOIN.LEFT_OUTER,
+                on=(ProjectShoppingLine.project == ProjectShoppingListStatus.project),
+            )
+            .where(ProjectShoppingListStatus.project == self)
+            .order_by(ProjectShoppingLine.position)
+            .dicts()
+        )
+
+    def shopping_lines(self, servings=None) -> list[ShoppingLine]:
+        """`shopping_list` as plain `ShoppingLine` values, categories included
+
+        Without `servings`, lines are read from the materialized shopping
+        list, computed again first when stale. The write lock is held from
+        the check to the write, so other connections can't mark the project
+        stale in between and have their change lost.
+        """
+        if servings is not None:
+            return self._compute_shopping_lines(servings)
+        rows = list(self._stored_lines_query())
+        if not rows:
+            with DB().atomic("IMMEDIATE"):
+                rows = list(self._stored_lines_query())  # refreshed meanwhile
+                if not rows:
+                    lines = self._compute_shopping_lines()
+                    self._materialize(lines)
+                    return lines
+        return [ShoppingLine.from_row(row) for row in rows if row["id"] is not None]
+
+    def iter_shopping_lines(self) -> Iterator[ShoppingLine]:
+        """`shopping_lines` sorted by category and name, read one at a time"""
+        fresh = ProjectShoppingListStatus.select().where(
+            ProjectShoppingListStatus.project == self
+        )
+        if not fresh.exists():
+            self.shopping_lines()
+        query = self._materialized_lines_query().order_by(
+            ProjectShoppingLine.category, ProjectShoppingLine.name
+        )
+        for row in query.dicts().iterator():
+            yield ShoppingLine.from_row(row)
 
     def priced_shopping_list(self):
         shopping_list = self.shopping_list()
@@ -268,14 +580,30 @@ class Project(BaseModel):
         ]
         return priced_shopping_list
 
+    def servings_sweep(self, variants) -> list[tuple[Ingredient, list[float]]]:
+        """Quantities of each ingredient for several numbers of persons
+
+        Quantities are linear in servings, so the shopping list is computed
+        once for one person and multiplied for each variant.
+        """
+        return [
+            (ingredient, [quantity * servings for servings in variants])
+            for ingredient, quantity in self.shopping_list(servings=1)
+        ]
+
     # --- prints
+    # rendering libraries are imported on use, to keep CLI startup fast
 
     def detail_printable(self):
+        from rich.console import Group
+        from rich.panel import Panel
+        from rich.text import Text
+
         return Panel(
             Group(
                 *(
                     Text(f"- {item.recipe.name!r} for {item.servings} persons")
-                    for item in self.items
+                    for item in catalog.project_items(self.id)
                 )
             ),
             title=f"Project: {self.name!r}",
@@ -283,22 +611,19 @@ class Project(BaseModel):
         )
 
     def shopping_list_table(self):
+        from prettytable import PrettyTable
+
         table = PrettyTable()
         table.field_names = ["ingredient", "quantity", "category"]
-        rows = [
-            (
-                ingredient.name,
-                f"{quantity:.1f} {ingredient.unit}",
-                ingredient.category,
+        for line in self.iter_shopping_lines():
+            table.add_row(
+                (line.name, f"{line.quantity:.1f} {line.unit}", line.category)
             )
-            for ingredient, quantity in self.shopping_list()
-        ]
-        rows = sorted(rows, key=lambda r: (r[2], r[0]))
-        for row in rows:
-            table.add_row(row)
         return table
 
     def priced_shopping_list_table(self):
+        from prettytable import PrettyTable
+
         table = PrettyTable()
         table.field_names = [
             "ingredient",
@@ -306,78 +631,277 @@ class Project(BaseModel):
             "price",
         ]
 
-        for ingredient, quantity, price in self.priced_shopping_list():
-            if price is not None:
-                price_str = f"({price} euros)"
+        for line in self.shopping_lines():
+            if line.cost is not None:
+                price_str = f"({line.cost} euros)"
             else:
                 price_str = f"(no price data)"
-            table.add_row(
-                (ingredient.name, f"{quantity:.1f} {ingredient.unit}", price_str)
-            )
+            table.add_row((line.name, f"{line.quantity:.1f} {line.unit}", price_str))
         return table
 
-    def csv_shopping_list(self):
-        file_sink = add_file_sink()
-        t = PrettyTable()
+    def servings_sweep_table(self, variants):
+        from prettytable import PrettyTable
 
-        t.field_names = ["ingredient", "quantity", "unit", "category"]
-        rows = [
-            (
-                ingredient.name,
-                f"{quantity:.1f}",
-                str(ingredient.unit),
-                ingredient.category,
-            )
-            for ingredient, quantity in self.shopping_list()
+        table = PrettyTable()
+        table.field_names = [
+            "ingredient",
+            *(
+                f"{title} ({servings})"
+                for servings in variants
+                for title in ("quantity", "price")
+            ),
         ]
-        rows = sorted(rows, key=lambda r: (r[3], r[0]))
-        for row in rows:
-            t.add_row(row)
-        logger.remove(file_sink)
-        return t.get_csv_string()
+        totals = [0.0] * len(variants)
+        # quantities are linear in servings, see `servings_sweep`
+        for line in self.shopping_lines(servings=1):
+            row = [line.name]
+            for index, servings in enumerate(variants):
+                quantity = line.quantity * servings
+                row.append(f"{quantity:.1f} {line.unit}")
+                if line.price is not None:
+                    price = line.price * quantity
+                    totals[index] += price
+                    row.append(f"{price:.2f}")
+                else:
+                    row.append("-")
+            table.add_row(row)
+        table.add_row(
+            ["total", *(value for total in totals for value in ("", f"{total:.2f}"))]
+        )
+        return table
 
     def compute(self): ...
 
 
+# units a merged ingredient is shown in, first present wins
+UNIT_PRIORITY = [Unit.KILOGRAM, Unit.LITER, Unit.TABLESPOON, Unit.TEASPOON, Unit.UNIT]
+
+
+def merge_units(rows) -> list[dict]:
+    """Merge shopping list rows of an ingredient name in different units
+
+    Rows whose units convert to the same base unit, see `base_unit`, become
+    one row. Its quantity is in the first unit of `UNIT_PRIORITY` present,
+    the other columns come from the row in that unit. Without a price, the
+    first row with one gives it, converted to that unit.
+    """
+    groups = {}
+    for row in rows:
+        base, factor = base_unit(row["unit"], row["density"], row["unit_weight"])
+        groups.setdefault((row["name"], base), []).append((row, factor))
+    merged = []
+    for group in groups.values():
+        row, factor = min(group, key=lambda pair: UNIT_PRIORITY.index(pair[0]["unit"]))
+        if len(group) > 1:
+            base_quantity = sum(r["scaled_quantity"] * f for r, f in group)
+            row = row | dict(
+                scaled_quantity=base_quantity / factor,
+                item_count=sum(r["item_count"] for r, _ in group),
+            )
+            if row["price"] is None:
+                priced = [(r, f) for r, f in group if r["price"] is not None]
+                if priced:
+                    priced_row, priced_factor = priced[0]
+                    row["price"] = priced_row["price"] * factor / priced_factor
+        merged.append(row)
+    return merged
+
+
+def _log_aggregation(item_count, line_count) -> None:
+    logger.info(f"aggregation reduced item list from {item_count} to {line_count}")
+
+
 class ProjectRecipe(BaseModel):
     """A dish of a project"""
 
-    project = peewee.ForeignKeyField(Project, backref="items")
-    recipe = peewee.ForeignKeyField(Recipe)
+    project = peewee.ForeignKeyField(Project, backref="items", index=False)
+    recipe = peewee.ForeignKeyField(Recipe, index=False)
     servings = peewee.IntegerField()
+    _stale_on_insert = True
+
+    class Meta:
+        # recipes of a project read from the index alone, projects of a recipe
+        indexes = [
+            (("project", "recipe", "servings"), False),
+            (("recipe", "project"), False),
+        ]
 
     def __repr__(self) -> str:
         return f"<ProjectItem(project={self.project!r},recipe={self.recipe!r},servings={self.servings})>"
 
+    def _affected_projects(self):
+        return [self.project_id]
 
-class ShoppingList(BaseModel):
-    """List of ingredients and quantities."""
 
-    name = peewee.CharField(unique=True)
+class ProjectShoppingLine(BaseModel):
+    """A line of the materialized shopping list of a project"""
+
+    project = peewee.ForeignKeyField(Project, index=False)
+    position = peewee.IntegerField()
+    ingredient = peewee.ForeignKeyField(Ingredient)
+    name = peewee.CharField()
+    unit = UnitField()
+    category = peewee.CharField()
+    quantity = peewee.FloatField()
+    price = peewee.FloatField(null=True)
+
+    class Meta:
+        indexes = [(("project", "position"), True)]
+
+
+class ProjectShoppingListStatus(BaseModel):
+    """Materialized shopping list of a project is up to date, if present"""
+
+    project = peewee.ForeignKeyField(Project, unique=True)
+    computed_at = peewee.DateTimeField(default=datetime.datetime.now)
+
+
+def projects_using_recipes(recipes):
+    """Query of the projects using `recipes`, ids or a query"""
+    return ProjectRecipe.select(ProjectRecipe.project).where(
+        ProjectRecipe.recipe.in_(recipes)
+    )
+
+
+def projects_using_ingredients(ingredients):
+    """Query of the projects with recipes using `ingredients`, ids or a query"""
+    return (
+        ProjectRecipe.select(ProjectRecipe.project)
+        .join(RecipeItem, on=(RecipeItem.recipe == ProjectRecipe.recipe))
+        .where(RecipeItem.ingredient.in_(ingredients))
+    )
+
+
+def mark_stale(projects) -> None:
+    """Have shopping lists of `projects`, ids or a query, computed again"""
+    ProjectShoppingListStatus.delete().where(
+        ProjectShoppingListStatus.project.in_(projects)
+    ).execute()
+
+
+def mark_all_stale() -> None:
+    ProjectShoppingListStatus.delete().execute()
+
+
+# ------------------------- catalog -------------------------
+
+
+class Catalog:
+    """In-process read-through cache of recipes, items, ingredients and tags
+
+    Records are loaded on first use with batched queries and kept in memory,
+    keyed by id. Writes through model instances (`save`, `create`,
+    `delete_instance`, so `add_item`, `add_tag`, `add_recipe` and
+    `create_from_file`) bump `generation`, which drops every cached record
+    on the next read. Writes made with queries, or rolled back, must call
+    `invalidate` themselves.
+    """
+
+    def __init__(self) -> None:
+        self.generation = 0
+        self._loaded_generation = 0
+        self._ingredients = {}  # ingredient id -> Ingredient, tags prefetched
+        self._recipes = {}  # recipe id -> Recipe
+        self._items = {}  # recipe id -> [RecipeItem]
+        self._project_items = {}  # project id -> [ProjectRecipe]
+
+    def invalidate(self) -> None:
+        self.generation += 1
+
+    def _check_generation(self) -> None:
+        if self._loaded_generation != self.generation:
+            self._ingredients.clear()
+            self._recipes.clear()
+            self._items.clear()
+            self._project_items.clear()
+            self._loaded_generation = self.generation
+
+    def prefetch_ingredients(self, ids) -> None:
+        self._check_generation()
+        missing = [id_ for id_ in dict.fromkeys(ids) if id_ not in self._ingredients]
+        loaded = []
+        for batch in peewee.chunked(missing, IN_QUERY_BATCH_SIZE):
+            loaded.extend(Ingredient.select().where(Ingredient.id.in_(batch)))
+        for ingredient in Ingredient.prefetch_tags(loaded):
+            self._ingredients[ingredient.id] = ingredient
+
+    def ingredient(self, id_) -> Ingredient:
+        self.prefetch_ingredients([id_])
+        return self._ingredients[id_]
+
+    def prefetch_items(self, recipe_ids) -> None:
+        self._check_generation()
+        missing = [id_ for id_ in dict.fromkeys(recipe_ids) if id_ not in self._items]
+        loaded = {id_: [] for id_ in missing}
+        for batch in peewee.chunked(missing, IN_QUERY_BATCH_SIZE):
+            items = (
+                RecipeItem.select()
+                .where(RecipeItem.recipe.in_(batch))
+                .order_by(RecipeItem.id)
+            )
+            for item in items:
+                loaded[item.recipe_id].append(item)
+        self.prefetch_ingredients(
+            item.ingredient_id for items in loaded.values() for item in items
+        )
+        for items in loaded.values():
+            for item in items:
+                item.ingredient = self._ingredients[item.ingredient_id]
+        self._items.update(loaded)
+
+    def items(self, recipe_id) -> list[RecipeItem]:
+        self.prefetch_items([recipe_id])
+        return list(self._items[recipe_id])
+
+    def project_items(self, project_id) -> list[ProjectRecipe]:
+        """Recipes of a project, with their items and ingredients loaded"""
+        self._check_generation()
+        if project_id not in self._project_items:
+            items = list(
+                ProjectRecipe.select(ProjectRecipe, Recipe)
+                .join(Recipe)
+                .where(ProjectRecipe.project == project_id)
+                .order_by(ProjectRecipe.id)
+            )
+            for item in items:
+                item.recipe = self._recipes.setdefault(item.recipe.id, item.recipe)
+            self.prefetch_items(item.recipe_id for item in items)
+            self._project_items[project_id] = items
+        return list(self._project_items[project_id])
+
+
+catalog = Catalog()
 
 
 # All model classes
 all_models = [
     Tag,
     Ingredient,
+    IngredientConversion,
     IngredientTag,
     Recipe,
     RecipeItem,
+    RecipeSource,
     Project,
     ProjectRecipe,
+    ProjectShoppingLine,
+    ProjectShoppingListStatus,
 ]
 # Entity models
 entity_models = [Tag, Ingredient, Recipe, Project]
 
 
 def create_tables() -> None:
-    """Create tables, if they don't exist"""
+    """Create tables, if they don't exist, and migrate older ones"""
+    from planner.migrations import migrate
+
     logger.debug("creating tables")
-    DB().create_tables(all_models)
+    migrate()
 
 
 def reset_tables() -> None:
     """Destructive reset"""
     logger.debug("reseting tables")
     DB().drop_tables(all_models)
-    DB().create_tables(all_models)
+    create_tables()
+    catalog.invalidate()
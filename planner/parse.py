@@ -10,10 +10,12 @@ from planner.io import load_yaml
 from planner.errors import ParsingError
 from planner.logging import logger
 
+MULTIPLE_WHITESPACES_REGEX = re.compile(r"\s{2,}")
+
 
 def normalize_string(string):
     """Reduce multiple whitespaces to one"""
-    return re.sub(r"\s{2,}", " ", string.lower().strip())
+    return MULTIPLE_WHITESPACES_REGEX.sub(" ", string.lower().strip())
 
 
 # ------------------------- recipe item -------------------------
@@ -27,6 +29,41 @@ class Unit(StrEnum):
     TABLESPOON = auto()
 
 
+# volume units -> factor to liters
+VOLUME_FACTORS = {Unit.LITER: 1, Unit.TABLESPOON: 0.015, Unit.TEASPOON: 0.005}
+
+
+def base_unit(unit: Unit, density=None, unit_weight=None) -> tuple[Unit, float]:
+    """Unit an ingredient quantity converts to, and the conversion factor
+
+    Volumes convert to liters, or to kilograms with a density in kg/l.
+    Units convert to kilograms with a unit weight in kg.
+    """
+    if unit in VOLUME_FACTORS:
+        if density is not None:
+            return Unit.KILOGRAM, VOLUME_FACTORS[unit] * density
+        return Unit.LITER, VOLUME_FACTORS[unit]
+    if unit == Unit.UNIT and unit_weight is not None:
+        return Unit.KILOGRAM, unit_weight
+    return unit, 1
+
+
+# unit symbol -> (unit, conversion factor to that unit)
+UNIT_ALIASES = {
+    **dict.fromkeys(["g", "gram", "grams"], (Unit.KILOGRAM, 1e-3)),
+    **dict.fromkeys(
+        ["kg", "kgs", "kilo", "kilos", "kilogram", "kilograms"], (Unit.KILOGRAM, 1)
+    ),
+    **dict.fromkeys(["ml", "mililiter", "mililiters"], (Unit.LITER, 1e-3)),
+    **dict.fromkeys(["cl", "centiliter", "centiliters"], (Unit.LITER, 1e-2)),
+    **dict.fromkeys(["dl", "deciliter", "deciliters"], (Unit.LITER, 1e-1)),
+    **dict.fromkeys(["l", "liter", "liters"], (Unit.LITER, 1)),
+    **dict.fromkeys([None, "", "u", "unit", "units"], (Unit.UNIT, 1)),
+    **dict.fromkeys(["tbsp", "tablespoon", "tablespoons"], (Unit.TABLESPOON, 1)),
+    **dict.fromkeys(["tsp", "teaspoon", "teaspoons"], (Unit.TEASPOON, 1)),
+}
+
+
 @dataclass
 class Quantity:
     number: int
@@ -39,93 +76,39 @@ class Quantity:
     def from_tuple(cls, number: int | None, unit_string: str | None) -> Self:
         if not isinstance(number, (int, float)):
             raise ValueError(f"not a number {number}")
-        match unit_string:
-            case "g" | "gram" | "grams":
-                return cls(number * 1e-3, Unit.KILOGRAM)
-            case "kg" | "kilo" | "kilos" | "kilogram" | "kilograms":
-                return cls(number, Unit.KILOGRAM)
-            case "ml" | "mililiter" | "mililiters":
-                return cls(number * 1e-3, Unit.LITER)
-            case "cl" | "centiliter" | "centiliters":
-                return cls(number * 1e-2, Unit.LITER)
-            case "dl" | "deciliter" | "deciliters":
-                return cls(number * 1e-1, Unit.LITER)
-            case "l" | "liter" | "liters":
-                return cls(number, Unit.LITER)
-            case None | "" | "u" | "unit" | "units":
-                return cls(number, Unit.UNIT)
-            case "tbsp" | "tablespoon" | "tablespoons":
-                return cls(number, Unit.TABLESPOON)
-            case "tsp" | "teaspoon" | "teaspoons":
-                return cls(number, Unit.TEASPOON)
-            case _:
-                raise ParsingError(f"unrecognized unit: {unit_string}")
+        try:
+            unit, factor = UNIT_ALIASES[unit_string]
+        except KeyError:
+            raise ParsingError(f"unrecognized unit: {unit_string}")
+        return cls(number * factor, unit)
+
+
+def _unit_symbols_regex():
+    # longest first, so that "kg" is not read as "k" followed by garbage
+    symbols = sorted(filter(None, UNIT_ALIASES), key=len, reverse=True)
+    return "|".join(map(re.escape, symbols))
+
+
+# applied on lowercased lines with compacted spaces
+ITEM_LINE_REGEX = re.compile(
+    r"(?P<number>[\d\.]+) ?"
+    rf"(?P<unit>{_unit_symbols_regex()})?(?=\s)\s*"
+    r"(?P<ingredient>[^(]*(?:\((?!.*\)).*)?)"  # an unclosed parenthesis is kept
+    r"(?:\(.*\).*)?$"  # parenthesis and what follows are comments
+)
 
 
 def _parse_item_line(line):
     """Parse elements out of an item line from a recipe file"""
-    # pre-process
-    line = line.lower()
-    line = re.sub(r"\s+", " ", line)  # conpact spaces
-    line = line.strip()  # remove border spaces
-
-    # regexes
-    UNIT_SYMBOLS = [
-        "g",
-        "gram",
-        "grams",
-        "kilo",
-        "kilos",
-        "kilogram",
-        "kilograms",
-        "kg",
-        "kgs",
-        "liter",
-        "L",
-        "l",
-        "ml",
-        "mililiter",
-        "mililiters",
-        "centiliter",
-        "centiliters",
-        "cl",
-        "tsp",
-        "teaspoon",
-        "teaspoons",
-        "tbsp",
-        "tablespoon",
-        "tablespoons",
-        "unit",
-        "units",
-    ]
-    UNIT_SYMBOL_REGEX = f"({'|'.join(UNIT_SYMBOLS)})"
-    NUMBER_REGEX = r"[\d\.]+"
-    QUANTITY_REGEX = NUMBER_REGEX + r"\s?" + f"{UNIT_SYMBOL_REGEX}?" + r"(?=\s)"
-    PARENTHESIS_REGEX = r"\((.*)\)"
-
-    # extract quantity
-    res = re.search(QUANTITY_REGEX, line)
-    if res is not None:
-        quantity = res.group()
-        rest = line[res.end() :].strip()
-    else:
+    line = " ".join(line.lower().split())  # compact spaces
+    res = ITEM_LINE_REGEX.search(line)
+    if res is None:
         raise ParsingError(f"quantity string not found in line {line!r}")
-    # extract number
-    res = re.search(NUMBER_REGEX, quantity)
-    number = float(res.group())
-    unit = quantity[res.end() :].strip() or None
-
+    number = float(res["number"])
     if number == 0:
         raise ParsingError(f"parsed number is zero in line {line}")
-
-    # extract parenthesis
-    res = re.search(PARENTHESIS_REGEX, rest)
-    if res is not None:
-        ingredient = rest[: res.start()].strip()
-    else:
-        ingredient = rest
-    quantity = Quantity.from_tuple(number, unit)
-    return quantity, ingredient
+    quantity = Quantity.from_tuple(number, res["unit"])
+    return quantity, res["ingredient"].rstrip()
 
 
 # ------------------------- recipe file -------------------------
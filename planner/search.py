@@ -0,0 +1,67 @@
+"""In-memory substring search over names
+
+Every substring of up to 3 characters of each name is indexed. A query of
+3 characters or less is a single lookup, longer ones intersect the sets of
+their trigrams and check the few remaining candidates.
+"""
+
+from collections import defaultdict
+from typing import Hashable, Iterable
+
+GRAM_SIZE = 3
+
+
+def _grams(text, size) -> set[str]:
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+class SearchIndex:
+    """Case-insensitive substring search returning keys in insertion order"""
+
+    def __init__(self, entries: Iterable[tuple[Hashable, str]] = ()) -> None:
+        self._names = {}  # key -> lowercase name
+        self._ranks = {}  # key -> insertion rank
+        self._grams = defaultdict(set)  # gram -> keys
+        self._next_rank = 0
+        for key, name in entries:
+            self.add(key, name)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _all_grams(self, name) -> set[str]:
+        return set().union(*(_grams(name, n) for n in range(1, GRAM_SIZE + 1)))
+
+    def add(self, key, name) -> None:
+        if key in self._names:
+            self.remove(key)
+        name = name.lower()
+        self._names[key] = name
+        self._ranks[key] = self._next_rank
+        self._next_rank += 1
+        for gram in self._all_grams(name):
+            self._grams[gram].add(key)
+
+    def remove(self, key) -> None:
+        name = self._names.pop(key)
+        del self._ranks[key]
+        for gram in self._all_grams(name):
+            self._grams[gram].discard(key)
+            if not self._grams[gram]:
+                del self._grams[gram]
+
+    def search(self, text) -> list:
+        """Keys of the names containing `text`"""
+        text = text.lower()
+        if not text:
+            return list(self._names)
+        if len(text) <= GRAM_SIZE:
+            matches = self._grams.get(text, set())
+        else:
+            gram_keys = sorted(
+                (self._grams.get(gram, set()) for gram in _grams(text, GRAM_SIZE)),
+                key=len,
+            )
+            candidates = set.intersection(*gram_keys)
+            matches = {key for key in candidates if text in self._names[key]}
+        return sorted(matches, key=self._ranks.__getitem__)
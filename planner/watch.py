@@ -0,0 +1,69 @@
+"""Follow recipe files and recompute a project shopping list on changes"""
+
+import itertools
+import math
+import time
+from pathlib import Path
+
+from planner import logger
+from planner.bulk import sync_recipe_files
+
+
+def snapshot(directory) -> dict[Path, tuple[int, int]]:
+    """Modification time and size of the files of a directory"""
+    state = {}
+    for path in Path(directory).iterdir():
+        if path.is_file():
+            stat = path.stat()
+            state[path] = (stat.st_mtime_ns, stat.st_size)
+    return state
+
+
+def changes(before, after) -> tuple[list[Path], list[Path]]:
+    """Changed and removed files between two snapshots"""
+    changed = sorted(path for path, state in after.items() if before.get(path) != state)
+    removed = sorted(path for path in before if path not in after)
+    return changed, removed
+
+
+def diff_shopping_lists(before, after):
+    """Ingredients whose quantity changed, as `(ingredient, before, after)`
+
+    Quantities are None for ingredients absent on one side.
+    """
+    before, after = dict(before), dict(after)
+    diff = []
+    for ingredient in [*before, *(i for i in after if i not in before)]:
+        old, new = before.get(ingredient), after.get(ingredient)
+        if old is None or new is None or not math.isclose(old, new):
+            diff.append((ingredient, old, new))
+    return diff
+
+
+def _follow(project, directory, interval, state, shopping_list, max_polls):
+    polls = itertools.count(1)
+    while max_polls is None or next(polls) <= max_polls:
+        time.sleep(interval)
+        new_state = snapshot(directory)
+        changed, removed = changes(state, new_state)
+        if not changed and not removed:
+            continue
+        logger.debug(f"{len(changed)} files changed, {len(removed)} removed")
+        state = new_state
+        report = sync_recipe_files(changed, removed=removed)
+        new_shopping_list = project.shopping_list()
+        yield report, diff_shopping_lists(shopping_list, new_shopping_list)
+        shopping_list = new_shopping_list
+
+
+def watch(project, directory, interval=0.5, max_polls=None):
+    """Iterate on `(sync report, shopping list diff)` each time files change
+
+    Files and shopping list are read when called, then the directory is
+    polled every `interval` seconds, at most `max_polls` times if given.
+    Only touched files are synchronized, the project shopping list is then
+    computed again.
+    """
+    state = snapshot(directory)
+    shopping_list = project.shopping_list()
+    return _follow(project, directory, interval, state, shopping_list, max_polls)
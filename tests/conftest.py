@@ -4,6 +4,7 @@ config.in_memory = True
 from pytest import fixture
 
 from planner import database, models
+from planner.parse import Quantity, Unit
 
 
 @fixture(scope="session")
@@ -16,3 +17,121 @@ def rollback_transaction(setup_db):
     with database.DB().atomic() as transaction:
         yield
         transaction.rollback()
+    models.catalog.invalidate()
+
+
+@fixture
+def count_queries(monkeypatch):
+    """Record SQL statements sent to the database"""
+    queries = []
+    db = database.DB()
+    execute_sql = db.execute_sql
+
+    def recording_execute_sql(sql, params=None, *args, **kwargs):
+        queries.append(sql)
+        return execute_sql(sql, params, *args, **kwargs)
+
+    monkeypatch.setattr(db, "execute_sql", recording_execute_sql)
+    return queries
+
+
+# ------------------------- model instances -------------------------
+
+# --- tags
+
+
+@fixture
+def fresh():
+    return models.Tag.create(name="fresh")
+
+
+@fixture
+def delicious():
+    return models.Tag.create(name="delicious")
+
+
+@fixture
+def uncommon():
+    return models.Tag.create(name="uncommon")
+
+
+# --- ingredients
+
+
+@fixture
+def pan():
+    return models.Ingredient.create(name="pan", unit=Unit.UNIT, price=1.5)
+
+
+@fixture
+def tomate():
+    return models.Ingredient.create(name="tomate", unit=Unit.KILOGRAM, price=3)
+
+
+@fixture
+def caracoles():
+    return models.Ingredient.create(name="caracoles", unit=Unit.KILOGRAM, price=12)
+
+
+@fixture
+def vinagre():
+    return models.Ingredient.create(name="vinagre", unit=Unit.LITER, price=2.5)
+
+
+# --- recipes
+
+
+@fixture
+def pan_con_tomate(pan, tomate):
+    recipe = models.Recipe.create(name="pan con tomate", serves=1)
+    models.RecipeItem.create(recipe=recipe, ingredient=tomate, quantity=0.1)
+    models.RecipeItem.create(recipe=recipe, ingredient=pan, quantity=1)
+    return recipe
+
+
+@fixture
+def caracoles_con_vinagre(caracoles, vinagre):
+    recipe = models.Recipe.create(name="caracoles con vinagre", serves=1)
+    models.RecipeItem.create(recipe=recipe, ingredient=caracoles, quantity=50)
+    models.RecipeItem.create(recipe=recipe, ingredient=vinagre, quantity=0.25)
+    return recipe
+
+
+# --- project
+
+
+@fixture
+def feast(pan_con_tomate, caracoles_con_vinagre):
+    feast = models.Project.create(name="feast")
+    models.ProjectRecipe.create(recipe=pan_con_tomate, project=feast, servings=5)
+    models.ProjectRecipe.create(recipe=caracoles_con_vinagre, project=feast, servings=5)
+    return feast
+
+
+@fixture
+def ensalada(feast):
+    """Recipe of feast with aceite in three volume units, tomate in units"""
+    recipe = models.Recipe.create(name="ensalada", serves=1)
+    recipe.add_item(Quantity.from_tuple(1, "tbsp"), "aceite")
+    recipe.add_item(Quantity.from_tuple(2, "tsp"), "aceite")
+    recipe.add_item(Quantity.from_tuple(0.1, "l"), "aceite")
+    recipe.add_item(Quantity.from_tuple(2, "u"), "tomate")
+    feast.add_recipe(recipe, servings=1)
+    return recipe
+
+
+# ------------------------- files -------------------------
+
+
+@fixture
+def write_recipe():
+    """Function writing a recipe file, returning its path"""
+
+    def write(directory, name, serves, items):
+        path = directory / name
+        path.write_text(
+            "\n".join([f"serves: {serves}", "---", *(f"- {item}" for item in items)])
+        )
+        return path
+
+    return write
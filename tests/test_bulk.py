@@ -0,0 +1,437 @@
+from pathlib import Path
+
+from pytest import fixture
+
+from planner import bulk, models
+from planner.errors import ParsingError
+from planner.io import load_all_yaml_from_file
+from planner.parse import Unit
+
+
+@fixture(autouse=True)
+def rollback_transaction_here(rollback_transaction): ...
+
+
+TEST_DATA = Path("tests/data")
+PAN_CON_TOMATE_RECIPE_FILE = TEST_DATA / "pan con tomate"
+BOCATA_DE_NADA_RECIPE = TEST_DATA / "bocata de nada"
+
+
+def recipe_content(name):
+    recipe = models.Recipe.get(name=name)
+    return recipe.serves, [
+        (item.quantity, str(item.ingredient.unit), item.ingredient.name)
+        for item in recipe.items.order_by(models.RecipeItem.id)
+    ]
+
+
+# ------------------------- ingredients -------------------------
+
+
+def test__resolve_ingredients():
+    pan = models.Ingredient.create(name="pan", unit=Unit.UNIT)
+    ids = bulk.resolve_ingredients(
+        [("pan", Unit.UNIT), ("tomate", Unit.KILOGRAM), ("pan", Unit.KILOGRAM)]
+    )
+    assert ids[("pan", Unit.UNIT)] == pan.id
+    assert models.Ingredient.get_by_id(ids[("tomate", Unit.KILOGRAM)]).name == "tomate"
+    assert (
+        models.Ingredient.get_by_id(ids[("pan", Unit.KILOGRAM)]).unit == Unit.KILOGRAM
+    )
+    assert models.Ingredient.select().count() == 3
+
+
+# ------------------------- recipes -------------------------
+
+
+def test__load_recipe_files():
+    report = bulk.load_recipe_files([PAN_CON_TOMATE_RECIPE_FILE, BOCATA_DE_NADA_RECIPE])
+    assert report.created == ["pan con tomate", "bocata de nada"]
+    assert report.errors == {}
+    assert recipe_content("pan con tomate") == (
+        2,
+        [(1.0, "unit", "pan"), (0.1, "kilogram", "tomate rallado")],
+    )
+    assert recipe_content("bocata de nada") == (
+        1,
+        [(1.0, "unit", "pancito"), (1.0, "liter", "aire")],
+    )
+    assert models.Recipe.get(name="pan con tomate").instructions == (
+        "grate the tomato\nput it on the bread"
+    )
+
+
+def test__load_recipe_files__same_as_create_from_file():
+    bulk.load_recipe_files([PAN_CON_TOMATE_RECIPE_FILE])
+    loaded = recipe_content("pan con tomate")
+    models.Recipe.get(name="pan con tomate").delete_instance(recursive=True)
+    models.Recipe.create_from_file(PAN_CON_TOMATE_RECIPE_FILE)
+    assert recipe_content("pan con tomate") == loaded
+
+
+def test__load_recipe_files__shared_ingredients(tmp_path, write_recipe):
+    bulk.load_recipe_files(
+        [
+            write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"]),
+            write_recipe(tmp_path, "sandwich", 1, ["2 pan", "50g queso"]),
+        ]
+    )
+    assert (
+        models.Ingredient.select().where(models.Ingredient.name == "pan").count() == 1
+    )
+
+
+def test__load_recipe_files__existing_recipe_skipped():
+    models.Recipe.create_from_file(PAN_CON_TOMATE_RECIPE_FILE)
+    report = bulk.load_recipe_files([PAN_CON_TOMATE_RECIPE_FILE, BOCATA_DE_NADA_RECIPE])
+    assert report.created == ["bocata de nada"]
+    assert report.skipped == ["pan con tomate"]
+    assert len(models.Recipe.get(name="pan con tomate").items) == 2
+
+
+def test__load_recipe_files__errors_reported(tmp_path, write_recipe):
+    broken = write_recipe(tmp_path, "broken", 1, ["some apples"])
+    no_serves = tmp_path / "no serves"
+    no_serves.write_text("persons: 2\n---\n- 1 apple")
+    report = bulk.load_recipe_files([broken, no_serves, BOCATA_DE_NADA_RECIPE])
+    assert report.created == ["bocata de nada"]
+    assert set(report.errors) == {broken, no_serves}
+    assert isinstance(report.errors[broken], ParsingError)
+    assert not models.Recipe.exists("broken")
+
+
+def test__load_recipe_files__query_count(tmp_path, count_queries, write_recipe):
+    paths = [
+        write_recipe(tmp_path, f"recipe {i}", 4, [f"{i + 1} pan", "100g queso"])
+        for i in range(50)
+    ]
+    report = bulk.load_recipe_files(paths)
+    assert len(report.created) == 50
+    assert len(count_queries) < 10
+
+
+# ------------------------- parallel parsing -------------------------
+
+
+def test__parse_recipe_files__parallel_same_as_serial(tmp_path, write_recipe):
+    paths = [
+        write_recipe(tmp_path, f"recipe {i}", 4, [f"{i + 1} pan", "100g queso"])
+        for i in range(10)
+    ]
+    paths.insert(3, write_recipe(tmp_path, "broken", 1, ["some apples"]))
+    serial = list(bulk.parse_recipe_files(paths, jobs=1))
+    parallel = list(bulk.parse_recipe_files(paths, jobs=2))
+    assert [path for path, _ in parallel] == paths
+    assert [parsed for _, parsed in parallel if not isinstance(parsed, Exception)] == [
+        parsed for _, parsed in serial if not isinstance(parsed, Exception)
+    ]
+    assert isinstance(dict(parallel)[paths[3]], ParsingError)
+
+
+def test__load_recipe_files__parallel():
+    report = bulk.load_recipe_files(
+        [PAN_CON_TOMATE_RECIPE_FILE, BOCATA_DE_NADA_RECIPE], jobs=2
+    )
+    assert report.created == ["pan con tomate", "bocata de nada"]
+
+
+# ------------------------- synchronization -------------------------
+
+
+def sync(directory, **kwargs):
+    return bulk.sync_recipe_directory(directory, **kwargs)
+
+
+def test__sync_recipe_directory__create(tmp_path, write_recipe):
+    write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"])
+    report = sync(tmp_path)
+    assert report.created == ["toast"]
+    assert recipe_content("toast") == (
+        1,
+        [(1.0, "unit", "pan"), (0.01, "kilogram", "butter")],
+    )
+    source = models.RecipeSource.get(path=str(tmp_path / "toast"))
+    assert source.recipe.name == "toast"
+
+
+def test__sync_recipe_directory__unchanged_no_writes(
+    tmp_path, count_queries, write_recipe
+):
+    write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"])
+    sync(tmp_path)
+    count_queries.clear()
+    report = sync(tmp_path)
+    assert report.unchanged == ["toast"]
+    assert report.created == report.updated == report.deleted == []
+    writes = [
+        sql for sql in count_queries if sql.split()[0] in ("INSERT", "UPDATE", "DELETE")
+    ]
+    assert writes == []
+
+
+def test__sync_recipe_directory__update(tmp_path, write_recipe):
+    write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter", "1 egg"])
+    sync(tmp_path)
+    write_recipe(tmp_path, "toast", 2, ["2 pan", "10g butter", "5g salt"])
+    report = sync(tmp_path)
+    assert report.updated == ["toast"]
+    assert recipe_content("toast") == (
+        2,
+        [
+            (2.0, "unit", "pan"),
+            (0.01, "kilogram", "butter"),
+            (0.005, "kilogram", "salt"),
+        ],
+    )
+
+
+def test__sync_recipe_directory__update_marks_projects_stale(tmp_path, write_recipe):
+    write_recipe(tmp_path, "toast", 1, ["1 pan"])
+    write_recipe(tmp_path, "sandwich", 1, ["2 pan"])
+    sync(tmp_path)
+    feast, picnic = (models.Project.create(name=name) for name in ["feast", "picnic"])
+    feast.add_recipe(models.Recipe.get(name="toast"), servings=5)
+    picnic.add_recipe(models.Recipe.get(name="sandwich"), servings=5)
+    feast.shopping_lines(), picnic.shopping_lines()
+    write_recipe(tmp_path, "toast", 1, ["3 pan"])
+    sync(tmp_path)
+    assert [status.project_id for status in models.ProjectShoppingListStatus] == [
+        picnic.id
+    ]
+    assert feast.shopping_list()[0][1] == 15
+
+
+def test__sync_recipe_directory__formatting_only(tmp_path, write_recipe):
+    write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"])
+    sync(tmp_path)
+    write_recipe(tmp_path, "toast", 1, ["1   pan", "10 g butter"])
+    report = sync(tmp_path)
+    assert report.unchanged == ["toast"]
+    assert report.updated == []
+
+
+def test__sync_recipe_directory__takes_over_loaded_recipe(tmp_path, write_recipe):
+    path = write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"])
+    bulk.load_recipe_files([path])
+    report = sync(tmp_path)
+    assert report.created == report.updated == []
+    assert models.RecipeSource.get(path=str(path)).recipe.name == "toast"
+
+
+def test__sync_recipe_directory__removed_file(tmp_path, write_recipe):
+    path = write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"])
+    write_recipe(tmp_path, "sandwich", 1, ["2 pan"])
+    sync(tmp_path)
+    path.unlink()
+    report = sync(tmp_path)
+    assert report.deleted == ["toast"]
+    assert not models.Recipe.exists("toast")
+    assert models.Recipe.exists("sandwich")
+
+
+def test__sync_recipe_directory__removed_file_used_in_project(tmp_path, write_recipe):
+    path = write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"])
+    sync(tmp_path)
+    models.Project.create(name="feast").add_recipe(
+        models.Recipe.get(name="toast"), servings=5
+    )
+    path.unlink()
+    report = sync(tmp_path)
+    assert report.deleted == []
+    assert path in report.errors
+    assert models.Recipe.exists("toast")
+
+
+def test__sync_recipe_directory__parse_error_keeps_recipe(tmp_path, write_recipe):
+    write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"])
+    sync(tmp_path)
+    path = write_recipe(tmp_path, "toast", 1, ["some pan"])
+    report = sync(tmp_path)
+    assert path in report.errors
+    assert recipe_content("toast")[1] == [
+        (1.0, "unit", "pan"),
+        (0.01, "kilogram", "butter"),
+    ]
+    # not recorded as synced, the file is parsed again next time
+    assert path in sync(tmp_path).errors
+
+
+# ------------------------- projects -------------------------
+
+
+def write_project(directory, name, servings, recipes):
+    path = directory / f"{name}.yaml"
+    path.write_text(
+        "\n".join([f"servings: {servings}", "recipes:", *(f"  - {r}" for r in recipes)])
+    )
+    return path
+
+
+def project_content(name):
+    project = models.Project.get(name=name)
+    items = project.items.order_by(models.ProjectRecipe.id)
+    return [(item.recipe.name, item.servings) for item in items]
+
+
+def test__import_project_files(tmp_path):
+    bulk.load_recipe_files([PAN_CON_TOMATE_RECIPE_FILE, BOCATA_DE_NADA_RECIPE])
+    report = bulk.import_project_files(
+        [
+            write_project(tmp_path, "lunch", 10, ["Pan con tomate", "bocata de nada"]),
+            write_project(tmp_path, "dinner", 4, ["bocata de nada"]),
+        ]
+    )
+    assert report.created == ["lunch", "dinner"]
+    assert project_content("lunch") == [("pan con tomate", 10), ("bocata de nada", 10)]
+    assert project_content("dinner") == [("bocata de nada", 4)]
+
+
+def test__import_project_files__missing_recipe(tmp_path):
+    bulk.load_recipe_files([BOCATA_DE_NADA_RECIPE])
+    report = bulk.import_project_files(
+        [write_project(tmp_path, "lunch", 10, ["pan con tomate", "bocata de nada"])]
+    )
+    assert report.missing_recipes == {"lunch": ["pan con tomate"]}
+    assert project_content("lunch") == [("bocata de nada", 10)]
+
+
+def test__import_project_files__existing_and_broken(tmp_path):
+    models.Project.create(name="lunch")
+    broken = tmp_path / "broken.yaml"
+    broken.write_text("servings: many\nrecipes: []")
+    report = bulk.import_project_files(
+        [write_project(tmp_path, "lunch", 10, ["pan con tomate"]), broken]
+    )
+    assert report.created == []
+    assert report.skipped == ["lunch"]
+    assert set(report.errors) == {broken}
+
+
+def test__import_project_files__shipped_projects(count_queries):
+    paths = sorted(Path("assets/projects").glob("*.yaml"))
+    report = bulk.import_project_files(paths)
+    assert len(report.created) == len(paths) == 9
+    assert report.errors == {}
+    assert len(count_queries) < 10
+
+
+# ------------------------- ingredient import -------------------------
+
+
+def test__import_ingredients():
+    report = bulk.import_ingredients(
+        [
+            dict(name="Pan", unit="unit", price=1.5, tags=["bakery"]),
+            dict(name="tomate", unit="kilogram", tags=["fresh", "red"]),
+        ]
+    )
+    assert report.created == [("pan", Unit.UNIT), ("tomate", Unit.KILOGRAM)]
+    assert report.tags_created == ["bakery", "fresh", "red"]
+    pan = models.Ingredient.get(name="pan")
+    assert pan.dump() == dict(name="pan", unit="unit", price=1.5, tags=["bakery"])
+    assert [tag.name for tag in models.Ingredient.get(name="tomate").tags] == [
+        "fresh",
+        "red",
+    ]
+
+
+def test__import_ingredients__upsert(fresh):
+    tomate = models.Ingredient.create(name="tomate", unit=Unit.KILOGRAM, price=3)
+    pan = models.Ingredient.create(name="pan", unit=Unit.UNIT, price=1)
+    tomate.add_tag(fresh)
+    report = bulk.import_ingredients(
+        [
+            dict(name="tomate", unit="kilogram", price=4, tags=["fresh", "red"]),
+            dict(name="pan", unit="unit", tags=[]),
+            dict(name="tomate", unit="unit"),
+        ]
+    )
+    assert report.created == [("tomate", Unit.UNIT)]
+    assert report.updated == [("tomate", Unit.KILOGRAM), ("pan", Unit.UNIT)]
+    assert report.tags_created == ["red"]
+    tomate = models.Ingredient.get_by_id(tomate.id)
+    assert tomate.price == 4
+    assert [tag.name for tag in tomate.tags] == ["fresh", "red"]
+    # a record without price keeps the existing one
+    assert models.Ingredient.get_by_id(pan.id).price == 1
+
+
+def test__import_ingredients__invalid_records():
+    report = bulk.import_ingredients(
+        [
+            dict(name="pan"),
+            dict(name="agua", unit="bottle"),
+            dict(name="sal", unit="kilogram"),
+        ]
+    )
+    assert list(report.errors) == [0, 1]
+    assert report.created == [("sal", Unit.KILOGRAM)]
+
+
+def test__import_ingredients__shipped_ingredients(count_queries):
+    records = list(load_all_yaml_from_file("assets/ingredients.yaml"))
+    report = bulk.import_ingredients(records)
+    assert len(report.created) == len({(r["name"], r["unit"]) for r in records})
+    assert models.Ingredient.select().count() == len(report.created)
+    # upsert, tag and link batches and a few lookups, not one per record
+    assert len(count_queries) < 20
+    exported = [
+        ingredient.dump()
+        for ingredient in models.Ingredient.prefetch_tags(models.Ingredient.select())
+    ]
+    assert bulk.import_ingredients(exported).created == []
+
+
+# ------------------------- tag update -------------------------
+
+
+def test__update_tags(tomate, pan, fresh, delicious, count_queries):
+    tomate.add_tag(fresh)
+    models.Ingredient.create(name="tomate", unit=Unit.UNIT)
+    count_queries.clear()
+    report = bulk.update_tags(
+        [
+            dict(name="Tomate", tags=["fresh", "delicious"]),
+            dict(name="pan", tags=["delicious", "crusty"]),
+            dict(name="agua", tags=["fresh"]),
+        ]
+    )
+    # ingredients, tags and existing links lookups, then a single insert and
+    # the stale marking of projects using the tagged ingredients
+    statements = [sql.split()[0] for sql in count_queries]
+    assert statements.count("INSERT") == 1
+    assert statements.count("SELECT") == 3
+    assert statements.count("DELETE") == 1
+    assert report.added == 4  # tags of both tomate units, delicious on pan
+    assert report.skipped == 1
+    assert report.missing_ingredients == ["agua"]
+    assert report.missing_tags == ["crusty"]
+    assert [tag.name for tag in models.Ingredient.get_by_id(tomate.id).tags] == [
+        "fresh",
+        "delicious",
+    ]
+
+
+def test__update_tags__marks_projects_stale(feast, pan_con_tomate, vinagre):
+    other = models.Project.create(name="other")
+    other.add_recipe(pan_con_tomate, 2)
+    feast.shopping_lines(), other.shopping_lines()
+    bulk.update_tags([dict(name="vinagre", tags=["fresh"])], create_tags=True)
+    assert [status.project_id for status in models.ProjectShoppingListStatus] == [
+        other.id
+    ]
+
+
+def test__update_tags__nothing_added_keeps_lists(feast, tomate, fresh):
+    tomate.add_tag(fresh)
+    feast.shopping_lines()
+    report = bulk.update_tags([dict(name="tomate", tags=["fresh", "missing"])])
+    assert report.added == 0
+    assert models.ProjectShoppingListStatus.select().count() == 1
+
+
+def test__update_tags__create_tags(pan):
+    report = bulk.update_tags([dict(name="pan", tags=["crusty"])], create_tags=True)
+    assert report.tags_created == ["crusty"]
+    assert report.missing_tags == []
+    assert [tag.name for tag in models.Ingredient.get_by_id(pan.id).tags] == ["crusty"]
@@ -0,0 +1,90 @@
+import os
+import pickle
+from pathlib import Path
+
+from pytest import fixture
+
+from planner import bulk
+from planner.cache import ParseCache
+from planner.parse import parse_recipe_file
+
+PAN_CON_TOMATE_RECIPE_FILE = Path("tests/data/pan con tomate")
+
+
+@fixture
+def cache(tmp_path):
+    return ParseCache(tmp_path / "cache", max_entries=2)
+
+
+@fixture
+def recipe_file(tmp_path):
+    path = tmp_path / "toast"
+    path.write_text("serves: 1\n---\n- 1 pan\n- 10g butter")
+    return path
+
+
+def test__ParseCache__miss(cache, recipe_file):
+    assert cache.get(recipe_file) is None
+    assert cache.misses == 1
+
+
+def test__ParseCache__hit(cache):
+    parsed = parse_recipe_file(PAN_CON_TOMATE_RECIPE_FILE)
+    cache.put(PAN_CON_TOMATE_RECIPE_FILE, parsed)
+    assert cache.get(PAN_CON_TOMATE_RECIPE_FILE) == parsed
+    assert cache.hits == 1
+
+
+def test__ParseCache__modified_file(cache, recipe_file):
+    cache.parse_recipe_file(recipe_file)
+    recipe_file.write_text("serves: 1\n---\n- 2 pan\n- 10g butter")
+    name, header, items, instructions = cache.parse_recipe_file(recipe_file)
+    assert items[0][0].number == 2
+    assert cache.hits == 0
+
+
+def test__ParseCache__corrupted_entry(cache, recipe_file):
+    cache.parse_recipe_file(recipe_file)
+    cache._entry(recipe_file).write_bytes(b"garbage")
+    assert cache.get(recipe_file) is None
+
+
+def test__ParseCache__truncated_entry(cache, recipe_file):
+    parsed = cache.parse_recipe_file(recipe_file)
+    entry = cache._entry(recipe_file)
+    entry.write_bytes(entry.read_bytes()[:-10])
+    assert cache.get(recipe_file) is None
+    assert not entry.exists()
+    assert cache.parse_recipe_file(recipe_file) == parsed
+
+
+def test__ParseCache__stale_format_entry(cache, recipe_file):
+    cache.parse_recipe_file(recipe_file)
+    # unpickles fine, but not to a packed recipe
+    cache._entry(recipe_file).write_bytes(pickle.dumps(("toast", {"serves": 1})))
+    assert cache.get(recipe_file) is None
+    assert cache.misses == 2
+
+
+def test__ParseCache__evict_least_recently_used(cache, tmp_path):
+    paths = []
+    for index in range(3):
+        path = tmp_path / f"recipe {index}"
+        path.write_text(f"serves: {index + 1}\n---\n- 1 pan")
+        cache.parse_recipe_file(path)
+        os.utime(cache._entry(path), ns=(index, index))
+        paths.append(path)
+    cache.get(paths[0])  # used recently, survives eviction
+    cache.evict()
+    assert len(list(cache.directory.iterdir())) == 2
+    assert cache.get(paths[1]) is None
+
+
+def test__parse_recipe_files__cached(cache, recipe_file, monkeypatch):
+    first = list(bulk.parse_recipe_files([recipe_file], cache=cache))
+
+    def fail(path):
+        raise AssertionError("file parsed again")
+
+    monkeypatch.setattr(bulk, "parse_recipe_file", fail)
+    assert list(bulk.parse_recipe_files([recipe_file], cache=cache)) == first
@@ -0,0 +1,18 @@
+from pytest import raises
+
+from planner import config
+from planner.database import DB, PROFILES
+from planner.errors import ConfigurationError
+
+
+def test__DB__fast_profile():
+    pragmas = DB.pragmas()
+    assert pragmas["foreign_keys"] == 1
+    assert pragmas["temp_store"] == 2  # memory
+    assert pragmas["cache_size"] == PROFILES["fast"]["cache_size"]
+
+
+def test__DB__unknown_profile(monkeypatch):
+    monkeypatch.setitem(config, "db_profile", "furious")
+    with raises(ConfigurationError):
+        DB.connect()
@@ -0,0 +1,169 @@
+import io
+import json
+import tarfile
+import zipfile
+
+from pytest import fixture, raises
+
+from planner import models
+from planner.export import export_project, write_shopping_list
+from planner.parse import Unit
+
+
+@fixture(autouse=True)
+def rollback_transaction_here(rollback_transaction):
+    pass
+
+
+LINES = [
+    models.ShoppingLine(1, "tomate", Unit.KILOGRAM, "fresh", 0.5, 3),
+    models.ShoppingLine(2, "pan", Unit.UNIT, "usual", 5, None),
+]
+
+
+def test__write_shopping_list__csv():
+    file = io.StringIO(newline="")
+    assert write_shopping_list(LINES, file) == 2
+    assert file.getvalue().splitlines() == [
+        "ingredient,quantity,unit,category",
+        "tomate,0.5,kilogram,fresh",
+        "pan,5.0,unit,usual",
+    ]
+
+
+def test__write_shopping_list__tsv():
+    file = io.StringIO(newline="")
+    write_shopping_list(LINES, file, "tsv")
+    assert file.getvalue().splitlines()[1] == "tomate\t0.5\tkilogram\tfresh"
+
+
+def test__write_shopping_list__jsonl():
+    file = io.StringIO()
+    write_shopping_list(LINES, file, "jsonl")
+    assert [json.loads(line) for line in file.getvalue().splitlines()] == [
+        dict(ingredient="tomate", quantity=0.5, unit="kilogram", category="fresh"),
+        dict(ingredient="pan", quantity=5, unit="unit", category="usual"),
+    ]
+
+
+def test__write_shopping_list__unknown_format():
+    with raises(ValueError):
+        write_shopping_list(LINES, io.StringIO(), "parquet")
+
+
+def test__write_shopping_list__lazy():
+    def lines():
+        yield LINES[0]
+        assert file.getvalue().count("\n") == 2  # header and first line written
+        yield LINES[1]
+
+    file = io.StringIO()
+    write_shopping_list(lines(), file)
+
+
+def test__write_shopping_list__project(feast, tomate, fresh):
+    tomate.add_tag(fresh)
+    file = io.StringIO(newline="")
+    write_shopping_list(feast.iter_shopping_lines(), file)
+    assert file.getvalue().splitlines() == [
+        "ingredient,quantity,unit,category",
+        "tomate,0.5,kilogram,fresh",
+        "caracoles,250.0,kilogram,usual",
+        "pan,5.0,unit,usual",
+        "vinagre,1.2,liter,usual",
+    ]
+
+
+# ------------------------- project -------------------------
+
+
+@fixture
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+PROJECT_FILES = [
+    "caracoles con vinagre.txt",
+    "logs.txt",
+    "pan con tomate.txt",
+    "shopping_list.csv",
+    "summary.txt",
+]
+
+
+def test__export_project__directory(feast, in_tmp_path):
+    target = export_project(feast, in_tmp_path / "projects" / "feast")
+    assert target == in_tmp_path / "projects" / "feast"
+    assert sorted(path.name for path in target.iterdir()) == PROJECT_FILES
+    assert (target / "pan con tomate.txt").read_text().split("\n")[:3] == [
+        "serves: 5.0",
+        "---",
+        "- 0.500 kilogram tomate",
+    ]
+    assert "aggregation reduced" in (target / "logs.txt").read_text()
+
+
+def test__export_project__zip(feast, in_tmp_path):
+    target = export_project(feast, in_tmp_path / "feast", archive="zip", jobs=2)
+    assert target.name == "feast.zip"
+    with zipfile.ZipFile(target) as archive:
+        assert sorted(archive.namelist()) == [f"feast/{n}" for n in PROJECT_FILES]
+        csv = archive.read("feast/shopping_list.csv").decode()
+    assert csv.splitlines()[1] == "caracoles,250.0,kilogram,usual"
+
+
+def test__export_project__tar(feast, in_tmp_path):
+    target = export_project(feast, in_tmp_path / "feast", archive="tar")
+    with tarfile.open(target) as archive:
+        assert sorted(archive.getnames()) == [f"feast/{n}" for n in PROJECT_FILES]
+        summary = archive.extractfile("feast/summary.txt").read().decode()
+    assert "'pan con tomate' for 5 persons" in summary
+
+
+def test__export_project__constant_queries(feast, in_tmp_path, count_queries):
+    feast.shopping_lines()  # materialized
+    count_queries.clear()
+    export_project(feast, in_tmp_path / "feast")
+    # project recipes, recipe items, ingredients, tags, the shopping list
+    # status and its lines
+    assert len(count_queries) == 6
+
+
+@fixture
+def picnic(pan_con_tomate):
+    picnic = models.Project.create(name="picnic")
+    picnic.add_recipe(recipe=pan_con_tomate, servings=3)
+    picnic.add_recipe(recipe=pan_con_tomate, servings=2)
+    picnic.add_recipe(recipe=pan_con_tomate, servings=2)
+    return picnic
+
+
+def test__export_project__repeated_recipe(picnic, in_tmp_path):
+    target = export_project(picnic, in_tmp_path / "picnic", jobs=4)
+    recipe_files = sorted(target.glob("pan con tomate*"))
+    assert [path.name for path in recipe_files] == [
+        "pan con tomate (2) 2.txt",
+        "pan con tomate (2).txt",
+        "pan con tomate (3).txt",
+    ]
+    assert recipe_files[2].read_text().startswith("serves: 3")
+
+
+def test__export_project__repeated_recipe_zip(picnic, in_tmp_path):
+    target = export_project(picnic, in_tmp_path / "picnic", archive="zip")
+    with zipfile.ZipFile(target) as archive:
+        names = archive.namelist()
+    assert len(names) == len(set(names)) == 6
+
+
+def test__export_project__replaces_directory(feast, in_tmp_path):
+    (in_tmp_path / "feast").mkdir()
+    (in_tmp_path / "feast" / "old.txt").write_text("old")
+    target = export_project(feast, in_tmp_path / "feast")
+    assert sorted(path.name for path in target.iterdir()) == PROJECT_FILES
+
+
+def test__export_project__unknown_archive(feast, in_tmp_path):
+    with raises(ValueError):
+        export_project(feast, in_tmp_path / "feast", archive="rar")
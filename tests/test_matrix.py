@@ -0,0 +1,56 @@
+from pytest import approx, fixture
+
+from planner import matrix, models
+
+
+@fixture(autouse=True)
+def rollback_transaction_here(rollback_transaction): ...
+
+
+@fixture
+def picnic(pan_con_tomate):
+    picnic = models.Project.create(name="picnic")
+    picnic.add_recipe(recipe=pan_con_tomate, servings=3)
+    picnic.add_recipe(recipe=pan_con_tomate, servings=2)
+    return picnic
+
+
+def test__RecipeMatrix__shopping_list(feast, pan_con_tomate, caracoles_con_vinagre):
+    recipe_matrix = matrix.RecipeMatrix.load()
+    shopping_list = recipe_matrix.shopping_list(
+        [(pan_con_tomate.id, 5), (caracoles_con_vinagre.id, 5)]
+    )
+    assert shopping_list == feast.shopping_list()
+
+
+def test__RecipeMatrix__merges_units(feast, ensalada):
+    (feast_list,) = matrix.shopping_lists([feast])
+    assert feast_list == feast.shopping_list()
+    assert [i.name for i, _ in feast_list].count("aceite") == 1
+    aceite = models.Ingredient.get(name="aceite", unit="liter")
+    assert dict(feast_list)[aceite] == approx(0.125)
+
+
+def test__RecipeMatrix__merges_with_conversion(feast, ensalada, tomate):
+    models.IngredientConversion.create(name="tomate", unit_weight=0.2)
+    (feast_list,) = matrix.shopping_lists([feast])
+    assert feast_list == feast.shopping_list()
+    assert dict(feast_list)[tomate] == approx(0.5 + 0.4)
+
+
+def test__RecipeMatrix__load_subset(pan_con_tomate, caracoles_con_vinagre, pan):
+    recipe_matrix = matrix.RecipeMatrix.load([pan_con_tomate.id])
+    assert list(recipe_matrix.rows) == [pan_con_tomate.id]
+    assert pan.id in recipe_matrix.columns
+    assert recipe_matrix.quantities.shape == (1, 2)
+
+
+def test__shopping_lists(feast, picnic, tomate, pan):
+    feast_list, picnic_list = matrix.shopping_lists([feast, picnic])
+    assert feast_list == feast.shopping_list()
+    assert picnic_list == [(tomate, approx(0.5)), (pan, 5)]
+
+
+def test__shopping_lists__query_count(feast, picnic, count_queries):
+    matrix.shopping_lists([feast, picnic] * 10)
+    assert len(count_queries) == 3
@@ -0,0 +1,73 @@
+from pytest import fixture
+
+from planner import database, migrations, models
+
+
+@fixture(autouse=True)
+def rollback_transaction_here(rollback_transaction): ...
+
+
+def index_names(table) -> set[str]:
+    return {index.name for index in database.DB().get_indexes(table)}
+
+
+@fixture
+def old_database():
+    """Database as created before migrations, schema version 0"""
+    db = database.DB()
+    db.drop_tables(
+        [
+            models.RecipeSource,
+            models.IngredientConversion,
+            models.ProjectShoppingLine,
+            models.ProjectShoppingListStatus,
+        ]
+    )
+    for index in index_names("recipeitem"):
+        db.execute_sql(f'DROP INDEX "{index}"')
+    db.execute_sql('CREATE INDEX "recipeitem_recipe_id" ON "recipeitem" ("recipe_id")')
+    db.execute_sql('CREATE TABLE "shoppinglist" ("id" INTEGER NOT NULL PRIMARY KEY)')
+    migrations.SchemaVersion.delete().execute()
+
+
+def test__migrate__up_to_date():
+    assert migrations.current_version() == migrations.LATEST_VERSION
+    assert migrations.migrate() == []
+
+
+def test__migrate__old_database(pan_con_tomate, old_database):
+    assert migrations.current_version() == 0
+    applied = migrations.migrate()
+    assert [migration.version for migration in applied] == [1, 2, 3, 4, 5]
+    assert migrations.current_version() == migrations.LATEST_VERSION
+    tables = database.DB().get_tables()
+    assert "projectshoppingline" in tables
+    assert "shoppinglist" not in tables
+    assert index_names("recipeitem") == {
+        "recipeitem_recipe_id_ingredient_id_quantity",
+        "recipeitem_ingredient_id_recipe_id",
+    }
+    # content is kept
+    assert len(models.catalog.items(pan_con_tomate.id)) == 2
+
+
+def test__migrate__resumes(old_database):
+    migrations.SchemaVersion.create(version=3, name="add_materialized_shopping_lists")
+    database.DB().create_tables([models.ProjectShoppingLine])
+    applied = migrations.migrate()
+    assert [migration.version for migration in applied] == [4, 5]
+
+
+def test__migrate__new_database():
+    database.DB().drop_tables(models.all_models)
+    migrations.SchemaVersion.delete().execute()
+    assert migrations.migrate() == []
+    assert migrations.current_version() == migrations.LATEST_VERSION
+    assert set(database.DB().get_tables()) == {
+        model._meta.table_name for model in models.all_models
+    } | {"schema_version"}
+
+
+def test__migrations__ordered():
+    versions = [migration.version for migration in migrations.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
@@ -1,10 +1,12 @@
+import sqlite3
+import threading
 from pathlib import Path
 
 import peewee
 import pytest
 from pytest import fixture, raises
 
-from planner import models
+from planner import database, migrations, models
 from planner.parse import Quantity, Unit
 
 
@@ -12,77 +14,6 @@ from planner.parse import Quantity, Unit
 def rollback_transaction_here(rollback_transaction): ...
 
 
-# --- tags
-
-
-@fixture
-def fresh():
-    return models.Tag.create(name="fresh")
-
-
-@fixture
-def delicious():
-    return models.Tag.create(name="delicious")
-
-
-@fixture
-def uncommon():
-    return models.Tag.create(name="uncommon")
-
-
-# --- ingredients
-
-
-@fixture
-def pan():
-    return models.Ingredient.create(name="pan", unit=Unit.UNIT, price=1.5)
-
-
-@fixture
-def tomate():
-    return models.Ingredient.create(name="tomate", unit=Unit.KILOGRAM, price=3)
-
-
-@fixture
-def caracoles():
-    return models.Ingredient.create(name="caracoles", unit=Unit.KILOGRAM, price=12)
-
-
-@fixture
-def vinagre():
-    return models.Ingredient.create(name="vinagre", unit=Unit.LITER, price=2.5)
-
-
-# --- recipes
-
-
-@fixture
-def pan_con_tomate(pan, tomate):
-    recipe = models.Recipe.create(name="pan con tomate", serves=1)
-    models.RecipeItem.create(recipe=recipe, ingredient=tomate, quantity=0.1)
-    models.RecipeItem.create(recipe=recipe, ingredient=pan, quantity=1)
-    return recipe
-
-
-@fixture
-def caracoles_con_vinagre(caracoles, vinagre):
-    recipe = models.Recipe.create(name="caracoles con vinagre", serves=1)
-    models.RecipeItem.create(recipe=recipe, ingredient=caracoles, quantity=50)
-    models.RecipeItem.create(recipe=recipe, ingredient=vinagre, quantity=0.25)
-    return recipe
-
-
-# --- project
-
-
-@fixture
-def feast(pan_con_tomate, caracoles_con_vinagre):
-    feast = models.Project.create(name="feast")
-    models.ProjectRecipe.create(recipe=pan_con_tomate, project=feast, servings=5)
-    models.ProjectRecipe.create(recipe=caracoles_con_vinagre, project=feast, servings=5)
-    return feast
-
-
 # ------------------------- tag -------------------------
 
 
@@ -228,6 +159,59 @@ def test__Ingredient__category_uncommon(tomate, fresh, uncommon):
     assert tomate.category == "uncommon"
 
 
+def test__Ingredient__prefetch_tags(pan, tomate, caracoles, fresh, uncommon):
+    tomate.add_tag(fresh)
+    caracoles.add_tag(fresh)
+    caracoles.add_tag(uncommon)
+    ingredients = models.Ingredient.prefetch_tags([pan, tomate, caracoles])
+    assert [ingredient.tags for ingredient in ingredients] == [
+        [],
+        [fresh],
+        [fresh, uncommon],
+    ]
+    assert [ingredient.category for ingredient in ingredients] == [
+        "usual",
+        "fresh",
+        "uncommon",
+    ]
+
+
+def test__Ingredient__prefetch_tags__single_query(
+    pan, tomate, caracoles, fresh, uncommon, count_queries
+):
+    ingredients = [pan, tomate, caracoles]
+    models.Ingredient.prefetch_tags(ingredients)
+    for ingredient in ingredients:
+        ingredient.tags, ingredient.category, ingredient.dump()
+    assert len(count_queries) == 1
+
+
+def test__Ingredient__add_tag__after_prefetch(tomate, fresh):
+    models.Ingredient.prefetch_tags([tomate])
+    tomate.add_tag(fresh)
+    assert tomate.tags == [fresh]
+
+
+def test__Ingredient__listing(pan, tomate, caracoles, fresh, uncommon, count_queries):
+    tomate.add_tag(fresh)
+    caracoles.add_tag(fresh)
+    caracoles.add_tag(uncommon)
+    count_queries.clear()
+    assert list(models.Ingredient.listing()) == [
+        (pan.id, "pan", Unit.UNIT, 1.5, None, "usual"),
+        (tomate.id, "tomate", Unit.KILOGRAM, 3, "fresh", "fresh"),
+        (caracoles.id, "caracoles", Unit.KILOGRAM, 12, "fresh, uncommon", "uncommon"),
+    ]
+    assert len(count_queries) == 1
+
+
+def test__Ingredient__listing__pages(pan, tomate, caracoles):
+    first_page = list(models.Ingredient.listing(limit=2))
+    assert [row[1] for row in first_page] == ["pan", "tomate"]
+    second_page = models.Ingredient.listing(after=first_page[-1][0], limit=2)
+    assert [row[1] for row in second_page] == ["caracoles"]
+
+
 # ------------------------- Recipe -------------------------
 
 
@@ -367,6 +351,259 @@ def test__Project__shopping_list(feast, pan, tomate, caracoles, vinagre):
     ]
 
 
+def test__Project__shopping_list__aggregates_across_recipes(
+    feast, pan_con_tomate, tomate
+):
+    bocadillo = models.Recipe.create(name="bocadillo", serves=2)
+    models.RecipeItem.create(recipe=bocadillo, ingredient=tomate, quantity=0.3)
+    feast.add_recipe(recipe=bocadillo, servings=10)
+    assert dict(feast.shopping_list())[tomate] == pytest.approx(2)
+
+
+def test__Project__shopping_list__single_query(feast, count_queries):
+    feast.shopping_list()
+    count_queries.clear()
+    feast.shopping_list()
+    assert len(count_queries) == 1
+
+
+def test__Project__shopping_lines(
+    feast, pan, tomate, caracoles, vinagre, fresh, uncommon
+):
+    tomate.add_tag(fresh)
+    caracoles.add_tag(fresh)
+    caracoles.add_tag(uncommon)
+    assert feast.shopping_lines() == [
+        (tomate.id, "tomate", Unit.KILOGRAM, "fresh", 0.5, 3),
+        (pan.id, "pan", Unit.UNIT, "usual", 5, 1.5),
+        (caracoles.id, "caracoles", Unit.KILOGRAM, "uncommon", 250, 12),
+        (vinagre.id, "vinagre", Unit.LITER, "usual", 1.25, 2.5),
+    ]
+
+
+def test__Project__shopping_lines__single_query(feast, count_queries):
+    feast.shopping_lines()
+    count_queries.clear()
+    feast.shopping_lines()
+    assert len(count_queries) == 1
+
+
+def test__Project__shopping_lines__servings_not_materialized(feast):
+    assert feast.shopping_lines(servings=10)[0].quantity == 1
+    assert feast.shopping_lines()[0].quantity == 0.5
+
+
+def test__Project__shopping_lines__empty(count_queries):
+    project = models.Project.create(name="empty")
+    assert project.shopping_lines() == []
+    count_queries.clear()
+    assert project.shopping_lines() == []
+    assert len(count_queries) == 1
+
+
+def quantities(project):
+    return {line.name: line.quantity for line in project.shopping_lines()}
+
+
+def test__Project__shopping_lines__stale_after_add_recipe(
+    feast, pan_con_tomate, caracoles_con_vinagre
+):
+    before = quantities(feast)
+    feast.add_recipe(pan_con_tomate, 5)
+    assert quantities(feast)["pan"] == 2 * before["pan"]
+
+
+def test__Project__shopping_lines__stale_after_add_item(feast, pan_con_tomate):
+    quantities(feast)
+    pan_con_tomate.add_item(Quantity.from_tuple(1, "l"), "vinagre")
+    assert quantities(feast)["vinagre"] == 1.25 + 5
+
+
+def test__Project__shopping_lines__stale_after_price(feast, pan):
+    feast.shopping_lines()
+    pan.price = 2
+    pan.save()
+    assert feast.shopping_lines()[1].price == 2
+
+
+def test__Project__shopping_lines__stale_after_tag(feast, tomate, fresh):
+    feast.shopping_lines()
+    tomate.add_tag(fresh)
+    assert feast.shopping_lines()[0].category == "fresh"
+    fresh.name = "new"
+    fresh.save()
+    assert models.ProjectShoppingListStatus.select().count() == 0
+
+
+def test__Project__shopping_lines__stale_after_conversion(feast):
+    feast.shopping_lines()
+    models.IngredientConversion.create(name="vinagre", density=0.5)
+    assert models.ProjectShoppingListStatus.select().count() == 0
+
+
+def test__Project__shopping_lines__other_projects_stay_fresh(
+    feast, pan_con_tomate, vinagre
+):
+    other = models.Project.create(name="other")
+    other.add_recipe(pan_con_tomate, 2)
+    feast.shopping_lines(), other.shopping_lines()
+    models.Ingredient.create(name="sal", unit=Unit.KILOGRAM)
+    vinagre.price = 3
+    vinagre.save()
+    assert [status.project_id for status in models.ProjectShoppingListStatus] == [
+        other.id
+    ]
+
+
+@fixture
+def file_database(tmp_path, monkeypatch):
+    """Models bound to a database file, so other connections can write to it"""
+    db = peewee.SqliteDatabase(tmp_path / "db.db", pragmas=database.PROFILES["fast"])
+    monkeypatch.setattr(database.DB, "_instance", db)
+    with db.bind_ctx(models.all_models + [migrations.SchemaVersion]):
+        models.create_tables()
+        yield db
+    db.close()
+
+
+def test__Project__shopping_lines__stale_during_compute(file_database, monkeypatch):
+    recipe = models.Recipe.create(name="toast", serves=1)
+    recipe.add_item(Quantity.from_tuple(1, "u"), "pan")
+    project = models.Project.create(name="breakfast")
+    project.add_recipe(recipe, 2)
+
+    def other_process():
+        # changes an item and marks the project stale, like a recipe sync
+        connection = sqlite3.connect(file_database.database, timeout=5)
+        with connection:
+            connection.execute('UPDATE "recipeitem" SET "quantity" = 3')
+            connection.execute('DELETE FROM "projectshoppingliststatus"')
+        connection.close()
+
+    writers = []
+    compute = models.Project._compute_shopping_lines
+
+    def compute_then_write(self, *args):
+        lines = compute(self, *args)
+        writers.append(threading.Thread(target=other_process))
+        writers[0].start()
+        writers[0].join(0.2)  # waits for the write lock
+        return lines
+
+    monkeypatch.setattr(models.Project, "_compute_shopping_lines", compute_then_write)
+    assert project.shopping_lines()[0].quantity == 2
+    writers[0].join()
+    monkeypatch.setattr(models.Project, "_compute_shopping_lines", compute)
+    assert project.shopping_lines()[0].quantity == 6
+
+
+def test__create__no_stale_marking(count_queries):
+    # new entities have no dependents
+    models.Tag.create(name="seasonal")
+    models.Ingredient.create(name="sal", unit=Unit.KILOGRAM)
+    models.Recipe.create(name="ensalada", serves=1)
+    models.Project.create(name="picnic")
+    assert [sql.split()[0] for sql in count_queries] == ["INSERT"] * 4
+
+
+def test__RecipeItem__create__stale(feast, pan_con_tomate, tomate):
+    feast.shopping_lines()
+    models.RecipeItem.create(recipe=pan_con_tomate, ingredient=tomate, quantity=1)
+    assert feast.shopping_lines()[0].quantity == pytest.approx(0.5 + 5)
+
+
+def test__ProjectRecipe__create__stale(feast, pan_con_tomate, pan):
+    feast.shopping_lines()
+    models.ProjectRecipe.create(project=feast, recipe=pan_con_tomate, servings=5)
+    assert quantities(feast)["pan"] == 10
+
+
+def test__IngredientTag__create__stale(feast, tomate, fresh):
+    feast.shopping_lines()
+    models.IngredientTag.create(ingredient=tomate, tag=fresh)
+    assert feast.shopping_lines()[0].category == "fresh"
+
+
+def test__Recipe__create_from_file__no_stale_marking(count_queries):
+    models.Recipe.create_from_file(PAN_CON_TOMATE_RECIPE_FILE)
+    assert not [sql for sql in count_queries if "projectshoppingliststatus" in sql]
+
+
+def test__ShoppingLine__cost():
+    line = models.ShoppingLine(1, "pan", Unit.UNIT, "usual", 4, 1.5)
+    assert line.cost == 6
+    assert line._replace(price=None).cost is None
+
+
+def test__Project__shopping_list_table(feast, tomate, fresh, count_queries):
+    tomate.add_tag(fresh)
+    feast.shopping_lines()
+    count_queries.clear()
+    table = feast.shopping_list_table()
+    assert len(count_queries) == 2
+    assert table.rows == [
+        ["tomate", "0.5 kilogram", "fresh"],
+        ["caracoles", "250.0 kilogram", "usual"],
+        ["pan", "5.0 unit", "usual"],
+        ["vinagre", "1.2 liter", "usual"],
+    ]
+
+
+def test__Project__shopping_list__merges_volumes(feast, ensalada):
+    aceite = models.Ingredient.get(name="aceite", unit=Unit.LITER)
+    shopping_list = dict(feast.shopping_list())
+    assert shopping_list[aceite] == pytest.approx(0.125)
+    assert [i.name for i in shopping_list].count("aceite") == 1
+    # no unit weight, units of tomate are not merged with kilograms
+    assert [i.name for i in shopping_list].count("tomate") == 2
+
+
+def test__Project__shopping_list__merged_price(feast, ensalada):
+    models.Ingredient.update(price=0.03).where(
+        models.Ingredient.name == "aceite", models.Ingredient.unit == Unit.TABLESPOON
+    ).execute()
+    models.mark_all_stale()
+    aceite = models.Ingredient.get(name="aceite", unit=Unit.LITER)
+    (line,) = [line for line in feast.shopping_lines() if line.name == "aceite"]
+    assert line.ingredient_id == aceite.id
+    assert line.price == pytest.approx(2)  # per liter
+
+
+def test__Project__shopping_list__merges_with_conversion(feast, ensalada, tomate):
+    models.IngredientConversion.create(name="tomate", unit_weight=0.2)
+    models.IngredientConversion.create(name="aceite", density=0.9)
+    shopping_list = dict(feast.shopping_list())
+    assert shopping_list[tomate] == pytest.approx(0.5 + 0.4)
+    assert [i.name for i in shopping_list] == [
+        "tomate",
+        "pan",
+        "caracoles",
+        "vinagre",
+        "aceite",
+    ]
+    aceite = models.Ingredient.get(name="aceite", unit=Unit.LITER)
+    assert shopping_list[aceite] == pytest.approx(0.125)
+
+
+def test__Project__shopping_lines__merges_units(feast, ensalada, tomate):
+    models.IngredientConversion.create(name="tomate", unit_weight=0.2)
+    lines = {line.name: line for line in feast.shopping_lines()}
+    assert lines["tomate"].quantity == pytest.approx(0.9)
+    assert lines["tomate"].cost == pytest.approx(2.7)
+    assert lines["aceite"].unit == Unit.LITER
+    streamed = {line.name: line for line in feast.iter_shopping_lines()}
+    assert streamed == lines
+
+
+def test__Project__shopping_list__tablespoons_and_teaspoons(feast):
+    recipe = models.Recipe.create(name="salsa", serves=1)
+    recipe.add_item(Quantity.from_tuple(1, "tbsp"), "sal")
+    recipe.add_item(Quantity.from_tuple(3, "tsp"), "sal")
+    feast.add_recipe(recipe, servings=1)
+    sal = models.Ingredient.get(name="sal", unit=Unit.TABLESPOON)
+    assert dict(feast.shopping_list())[sal] == pytest.approx(2)
+
+
 def test__Project__priced_shopping_list(feast, pan, tomate, caracoles, vinagre):
     priced_shopping_list = feast.priced_shopping_list()
     assert priced_shopping_list == [
@@ -375,3 +612,119 @@ def test__Project__priced_shopping_list(feast, pan, tomate, caracoles, vinagre):
         (caracoles, 250, 3000),
         (vinagre, 1.25, 3.125),
     ]
+
+
+def test__Project__shopping_list__servings(feast, pan, tomate, caracoles, vinagre):
+    feast.add_recipe(recipe=models.Recipe.get(name="pan con tomate"), servings=100)
+    assert feast.shopping_list(servings=2) == [
+        (tomate, pytest.approx(0.4)),
+        (pan, 4),
+        (caracoles, 100),
+        (vinagre, 0.5),
+    ]
+
+
+def test__Project__servings_sweep(feast, pan, tomate, caracoles, vinagre):
+    assert feast.servings_sweep([1, 10]) == [
+        (tomate, [0.1, 1]),
+        (pan, [1, 10]),
+        (caracoles, [50, 500]),
+        (vinagre, [0.25, 2.5]),
+    ]
+
+
+def test__Project__servings_sweep__single_query(feast, count_queries):
+    feast.servings_sweep(range(100, 1000, 10))
+    assert len(count_queries) == 1
+
+
+def test__Project__servings_sweep_table(feast):
+    table = feast.servings_sweep_table([4, 8])
+    assert table.field_names == [
+        "ingredient",
+        "quantity (4)",
+        "price (4)",
+        "quantity (8)",
+        "price (8)",
+    ]
+    assert table.rows[0] == ["tomate", "0.4 kilogram", "1.20", "0.8 kilogram", "2.40"]
+    assert table.rows[-1] == ["total", "", "2409.70", "", "4819.40"]
+
+
+# ------------------------- Catalog -------------------------
+
+
+def test__Catalog__project_rendering__constant_queries(feast, count_queries):
+    str(feast)
+    feast.detail_printable()
+    for item in models.catalog.project_items(feast.id):
+        item.recipe.as_text(servings=item.servings)
+        item.recipe.item_section
+        for recipe_item in models.catalog.items(item.recipe.id):
+            recipe_item.ingredient.category
+    # project recipes, recipe items, ingredients and tags
+    assert len(count_queries) == 4
+
+
+def test__Catalog__cached(feast, count_queries):
+    str(feast)
+    count_queries.clear()
+    str(feast)
+    feast.detail_printable()
+    assert count_queries == []
+
+
+def test__Catalog__add_item__invalidates(pan_con_tomate):
+    assert len(pan_con_tomate.item_section.split("\n")) == 3
+    pan_con_tomate.add_item(Quantity.from_tuple(1, "l"), "aceite")
+    assert pan_con_tomate.item_section.split("\n")[-1] == "- 1.0 liter aceite"
+
+
+def test__Catalog__add_tag__invalidates(tomate, fresh):
+    ingredient = models.catalog.ingredient(tomate.id)
+    assert ingredient.category == "usual"
+    tomate.add_tag(fresh)
+    assert models.catalog.ingredient(tomate.id).category == "fresh"
+
+
+def test__Catalog__add_recipe__invalidates(feast, pan_con_tomate):
+    assert str(feast) == "feast: 2 recipes"
+    feast.add_recipe(pan_con_tomate, 2)
+    assert str(feast) == "feast: 3 recipes"
+
+
+def test__Catalog__invalidate(pan_con_tomate, pan):
+    models.catalog.items(pan_con_tomate.id)
+    models.RecipeItem.delete().where(models.RecipeItem.ingredient == pan).execute()
+    models.catalog.invalidate()
+    assert len(models.catalog.items(pan_con_tomate.id)) == 1
+
+
+# ------------------------- indexes -------------------------
+
+
+HOT_QUERIES = {
+    "shopping list": lambda project: project._shopping_lines_query(),
+    "materialized shopping list": lambda project: project._materialized_lines_query(),
+    "ingredient listing": lambda project: models.Ingredient.listing(after=0, limit=10),
+    "ingredient by name": lambda project: models.Ingredient.select().where(
+        models.Ingredient.name == "pan"
+    ),
+    "ingredients of a tag": lambda project: models.IngredientTag.select(
+        models.IngredientTag.ingredient
+    ).where(models.IngredientTag.tag == 1),
+    "projects of ingredients": lambda project: models.projects_using_ingredients([1]),
+    "projects of recipes": lambda project: models.projects_using_recipes([1]),
+}
+
+
+def query_plan(query) -> list[str]:
+    sql, params = query.sql()
+    cursor = database.DB().execute_sql(f"EXPLAIN QUERY PLAN {sql}", params)
+    return [detail for *_, detail in cursor]
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test__hot_queries__no_full_scan(feast, name):
+    plan = query_plan(HOT_QUERIES[name](feast))
+    assert [step for step in plan if step.startswith("SCAN")] == []
@@ -5,6 +5,7 @@ from planner.parse import (
     Quantity,
     Unit,
     _parse_item_line,
+    base_unit,
     _split_recipe_file,
     parse_recipe_file,
 )
@@ -33,6 +34,22 @@ def test_quantity__conversions():
     assert Quantity.from_tuple(10, "dl") == Quantity(1, Unit.LITER)
 
 
+@pytest.mark.parametrize(
+    "unit,density,unit_weight,expected",
+    [
+        (Unit.TABLESPOON, None, None, (Unit.LITER, 0.015)),
+        (Unit.TEASPOON, None, None, (Unit.LITER, 0.005)),
+        (Unit.LITER, 0.9, None, (Unit.KILOGRAM, 0.9)),
+        (Unit.TABLESPOON, 0.9, None, (Unit.KILOGRAM, pytest.approx(0.0135))),
+        (Unit.UNIT, None, None, (Unit.UNIT, 1)),
+        (Unit.UNIT, None, 0.2, (Unit.KILOGRAM, 0.2)),
+        (Unit.KILOGRAM, 0.9, 0.2, (Unit.KILOGRAM, 1)),
+    ],
+)
+def test_base_unit(unit, density, unit_weight, expected):
+    assert base_unit(unit, density, unit_weight) == expected
+
+
 # ------------------------- parse item line -------------------------
 
 
@@ -81,10 +98,30 @@ def test__parse_item_line__parenthesis():
     )
 
 
+def test__parse_item_line__unclosed_parenthesis():
+    assert _parse_item_line("1.5 l milk (cold") == (
+        Quantity(1.5, Unit.LITER),
+        "milk (cold",
+    )
+
+
+def test__parse_item_line__text_after_parenthesis():
+    assert _parse_item_line("12g ganja (well dried) in a jar") == (
+        Quantity(0.012, Unit.KILOGRAM),
+        "ganja",
+    )
+
+
 def test__parse_item_line__units():
     assert _parse_item_line("2kg rice") == (Quantity(2, Unit.KILOGRAM), "rice")
 
 
+def test__parse_item_line__unit_aliases():
+    assert _parse_item_line("5dl water") == (Quantity(0.5, Unit.LITER), "water")
+    assert _parse_item_line("2 kgs rice") == (Quantity(2, Unit.KILOGRAM), "rice")
+    assert _parse_item_line("3 liters milk") == (Quantity(3, Unit.LITER), "milk")
+
+
 def test__parse_item_line__float():
     assert _parse_item_line("2.5kg rice") == (Quantity(2.5, Unit.KILOGRAM), "rice")
 
@@ -0,0 +1,54 @@
+from planner.search import SearchIndex
+
+NAMES = ["tomate", "pan", "Patata", "aceite de oliva", "tomatillo"]
+
+
+def index():
+    return SearchIndex(enumerate(NAMES))
+
+
+def brute_force(text):
+    return [key for key, name in enumerate(NAMES) if text.lower() in name.lower()]
+
+
+def test__SearchIndex__empty_query():
+    assert index().search("") == [0, 1, 2, 3, 4]
+
+
+def test__SearchIndex__short_query():
+    assert index().search("pa") == [1, 2]
+    assert index().search("E") == [0, 3]
+
+
+def test__SearchIndex__long_query():
+    assert index().search("tomat") == [0, 4]
+    assert index().search("de oli") == [3]
+    assert index().search("tomatoes") == []
+
+
+def test__SearchIndex__same_as_substring_search():
+    search_index = index()
+    queries = {
+        name[i:j]
+        for name in NAMES
+        for i in range(len(name))
+        for j in range(i, len(name) + 1)
+    }
+    for query in [*queries, "x", "tomx", "atat"]:
+        assert search_index.search(query) == brute_force(query), query
+
+
+def test__SearchIndex__remove():
+    search_index = index()
+    search_index.remove(0)
+    assert search_index.search("tom") == [4]
+    assert len(search_index) == 4
+
+
+def test__SearchIndex__add_keeps_insertion_order():
+    search_index = index()
+    search_index.add(5, "pan de ajo")
+    assert search_index.search("pan") == [1, 5]
+    search_index.add(1, "pan integral")
+    assert search_index.search("pan") == [5, 1]
+    assert search_index.search("ajo") == [5]
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# only imported by the commands rendering with them
+RENDERING_MODULES = ["textual", "prettytable", "rich.console", "rich.table"]
+# only imported by the commands using the database
+DATABASE_MODULES = ["peewee", "yaml", "planner.models", "planner.bulk"]
+
+
+def import_times(module) -> dict[str, float]:
+    """Cumulative import time of each module, from `python -X importtime`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test__cli_startup__rendering_modules_not_imported():
+    times = import_times("cli.cli")
+    assert [module for module in RENDERING_MODULES if module in times] == []
+
+
+def test__cli_startup__database_modules_not_imported():
+    times = import_times("cli.cli")
+    assert [module for module in DATABASE_MODULES if module in times] == []
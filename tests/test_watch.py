@@ -0,0 +1,59 @@
+import os
+
+from pytest import fixture
+
+from planner import bulk, models, watch
+from planner.parse import Unit
+
+
+@fixture(autouse=True)
+def rollback_transaction_here(rollback_transaction): ...
+
+
+def test__changes(tmp_path, write_recipe):
+    kept = write_recipe(tmp_path, "kept", 1, ["1 pan"])
+    edited = write_recipe(tmp_path, "edited", 1, ["1 pan"])
+    removed = write_recipe(tmp_path, "removed", 1, ["1 pan"])
+    before = watch.snapshot(tmp_path)
+    write_recipe(tmp_path, "edited", 1, ["12 pan"])
+    removed.unlink()
+    added = write_recipe(tmp_path, "added", 1, ["1 pan"])
+    changed, removed_paths = watch.changes(before, watch.snapshot(tmp_path))
+    assert changed == [added, edited]
+    assert removed_paths == [removed]
+    assert kept not in changed
+
+
+def test__diff_shopping_lists():
+    pan = models.Ingredient(name="pan", unit=Unit.UNIT, id=1)
+    tomate = models.Ingredient(name="tomate", unit=Unit.KILOGRAM, id=2)
+    aceite = models.Ingredient(name="aceite", unit=Unit.LITER, id=3)
+    diff = watch.diff_shopping_lists(
+        [(pan, 2), (tomate, 0.5)], [(pan, 2), (tomate, 0.75), (aceite, 0.1)]
+    )
+    assert diff == [(tomate, 0.5, 0.75), (aceite, None, 0.1)]
+    assert watch.diff_shopping_lists([(pan, 2)], []) == [(pan, 2, None)]
+
+
+def test__watch(tmp_path, write_recipe):
+    write_recipe(tmp_path, "toast", 1, ["1 pan", "10g butter"])
+    bulk.sync_recipe_directory(tmp_path)
+    feast = models.Project.create(name="feast")
+    feast.add_recipe(models.Recipe.get(name="toast"), servings=10)
+    updates = watch.watch(feast, tmp_path, interval=0, max_polls=10)
+    # size and modification time both change, even on coarse clocks
+    toast = write_recipe(tmp_path, "toast", 1, ["20 pan", "10g butter"])
+    stat = toast.stat()
+    os.utime(toast, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    report, diff = next(updates)
+    assert report.updated == ["toast"]
+    assert [(ingredient.name, before, after) for ingredient, before, after in diff] == [
+        ("pan", 10, 200)
+    ]
+
+
+def test__watch__max_polls(tmp_path, write_recipe):
+    write_recipe(tmp_path, "toast", 1, ["1 pan"])
+    bulk.sync_recipe_directory(tmp_path)
+    feast = models.Project.create(name="feast")
+    assert list(watch.watch(feast, tmp_path, interval=0, max_polls=3)) == []